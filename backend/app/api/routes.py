@@ -535,11 +535,12 @@ async def tdl_download_from_task(
         raise HTTPException(status_code=404, detail="任务不存在")
     
     # 从下载队列中找到对应的项并生成链接
-    urls = []
-    for item in task.download_queue:
-        if item.id in item_ids:
-            url = tdl_integration.generate_telegram_link(item.chat_id, item.message_id)
-            urls.append(url)
+    wanted_ids = set(item_ids)
+    selected = [item for item in task.download_queue if item.id in wanted_ids]
+    urls = tdl_integration.generate_telegram_links(
+        [item.chat_id for item in selected],
+        [item.message_id for item in selected]
+    )
     
     if not urls:
         raise HTTPException(status_code=400, detail="未找到指定的下载项")
@@ -3,416 +3,920 @@ TDL Integration Module - 异步版本
 TDL 仅作为单文件下载器，使用异步 Docker API 通信
 """
 import os
+import re
 import json
+import codecs
+import shlex
+import functools
+import collections
+import time
+import struct
 import asyncio
 import logging
-from typing import Optional, Dict, Any, Union, List
+import urllib.parse
+from typing import Optional, Dict, Any, Union, List, Tuple, AsyncIterator, Callable, Awaitable
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时退回标准库
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+
+def _json_dumps(obj) -> bytes:
+    """序列化为 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+
+def _json_loads(data: Union[bytes, bytearray]):
+    """从 bytes 直接解析 JSON (orjson 无需先解码为 str)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data.decode(errors='replace'))
+
+
 # Docker socket 路径
 DOCKER_SOCKET = "/var/run/docker.sock"
 
+# 单个连接的初始接收缓冲区大小 (不够时自动扩容)
+READ_BUFFER_SIZE = 64 * 1024
+# 空闲读缓冲区池的上限
+READ_BUFFER_POOL_SIZE = 8
+# keep-alive 空闲连接池的上限
+DOCKER_POOL_SIZE = 4
+# 可以安全重放的请求方法: 复用的空闲连接失效时只对这些请求换连接重试
+_IDEMPOTENT_METHODS = frozenset(("GET", "HEAD"))
+# socket 不存在时重新检查的最小间隔 (秒)
+SOCKET_RECHECK_INTERVAL = 5.0
+# 容器运行状态的缓存时间 (秒)，合并短时间内的重复状态查询
+RUNNING_CACHE_TTL = 2.0
+# /version 检查成功后的缓存时间 (秒)，只缓存成功结果，Docker 不可用时每次都重新检查
+VERSION_CACHE_TTL = 60.0
+
+# Docker 多路复用流帧头: 1 字节流类型 + 3 字节填充 + 4 字节大端长度
+_FRAME_HDR = struct.Struct(">BxxxI")
+
+# exec 输出日志: 执行期间写在下载目录，结束后删除，失败时只把末尾一小段送回输出流
+TDL_LOG_NAME = ".tdl.log"
+# 同时执行的 tdl exec 总数上限 (所有容器合计)，避免压垮 Docker API
+TDL_MAX_CONCURRENT = 4
+LOG_TAIL_BYTES = 4096
+# 容器内的日志包装脚本: 目录不存在时先创建; 失败时把日志末尾写到 stderr; 无论成败都删除日志
+_LOG_WRAPPER = (
+    'f="$1"; shift; mkdir -p "$(dirname "$f")" && "$@" > "$f" 2>&1; rc=$?; '
+    f'[ "$rc" -ne 0 ] && tail -c {LOG_TAIL_BYTES} "$f" >&2; rm -f "$f"; exit $rc'
+)
+# attach 模式下 exec 输出在内存中最多保留的末尾字节数
+EXEC_OUTPUT_LIMIT = 64 * 1024
+# exec 状态轮询: 从 0.1 秒开始按 1.3 倍递增，最长 3 秒
+POLL_INTERVAL_MIN = 0.1
+POLL_INTERVAL_MAX = 3.0
+POLL_BACKOFF = 1.3
+# 卡死检测回调的调用间隔 (秒)，由独立任务按此节奏检查，与状态轮询互不影响
+STUCK_CHECK_INTERVAL = 10.0
+
+# tdl dl 基础命令与每次都相同的参数
+_BASE_CMD = ("tdl", "dl")
+_RESUME_ARGS = ("--skip-same", "--continue")
+# tdl dl 默认文件名模板: {消息ID}-{去掉负号的会话ID}-{原文件名}
+_DEFAULT_TEMPLATE = '{{.MessageID}}-{{printf "%d" .DialogID | replace "-" ""}}-{{.FileName}}'
+_DEFAULT_TEMPLATE_ARGS = ("--template", _DEFAULT_TEMPLATE)
+
+# 超级群组/频道的 Bot API ID 为 -(10^12 + channel_id)，即字符串形式的 "-100" 前缀
+_SUPERGROUP_PREFIX = 1_000_000_000_000
+
+# exec create 请求体的固定部分，只需拼接 Cmd 数组 (关闭 TTY 以便清晰区分 stdout/stderr)
+_EXEC_CREATE_PREFIX = b'{"AttachStdin":false,"AttachStdout":true,"AttachStderr":true,"Tty":false,"Cmd":'
+
+
+# exec inspect 轮询只需要这两个字段，直接在 bytes 上提取
+_EXEC_RUNNING_RE = re.compile(rb'"Running"\s*:\s*(true|false)')
+_EXEC_EXIT_CODE_RE = re.compile(rb'"ExitCode"\s*:\s*(-?\d+)')
+
+
+def _parse_exec_state(body: Union[bytes, bytearray]) -> Tuple[bool, Optional[int]]:
+    """从 exec inspect 响应中提取 (Running, ExitCode)，字段缺失时退回完整 JSON 解析"""
+    running = _EXEC_RUNNING_RE.search(body)
+    if running is None:
+        try:
+            data = _json_loads(body)
+        except json.JSONDecodeError:
+            data = None
+        if not isinstance(data, dict):
+            return False, None
+        return bool(data.get("Running")), data.get("ExitCode")
+    exit_code = _EXEC_EXIT_CODE_RE.search(body)
+    return running.group(1) == b"true", int(exit_code.group(1)) if exit_code else None
+
+
+def _parse_status_code(head: Union[bytes, bytearray]) -> int:
+    """从响应头解析状态码，只转换状态码这 3 个字节"""
+    # 常规状态行 "HTTP/1.1 200 OK": 状态码固定位于第 9~11 字节
+    if head[8:9] == b" " and head[12:13] in (b" ", b"\r"):
+        try:
+            return int(head[9:12])
+        except ValueError:
+            return 0
+    status_line, _, _ = head.partition(b"\r\n")
+    parts = status_line.split(None, 2)
+    try:
+        return int(parts[1]) if len(parts) >= 2 else 0
+    except ValueError:
+        return 0
+
+
+def _parse_headers(head: Union[bytes, bytearray]) -> Dict[bytes, bytes]:
+    """把响应头解析为 {小写名称: 值} (均为 bytes)，跳过状态行
+    
+    只对名称部分做 lower()，不复制整个头部。
+    """
+    headers = {}
+    pos = head.find(b"\r\n") + 2
+    end = len(head)
+    while pos < end:
+        line_end = head.find(b"\r\n", pos)
+        if line_end == -1:
+            line_end = end
+        colon = head.find(b":", pos, line_end)
+        if colon != -1:
+            headers[bytes(head[pos:colon].strip().lower())] = head[colon + 1:line_end].strip()
+        pos = line_end + 2
+    return headers
+
+
+class _DockerProtocol(asyncio.BufferedProtocol):
+    """Docker socket 接收协议 (v2.3.3)
+    
+    基于 BufferedProtocol: 内核数据直接 recv_into 到预分配的 bytearray，
+    省去 StreamReader 先生成 bytes 再 feed_data 拷贝进内部缓冲区的一次拷贝。
+    """
+    
+    def __init__(self, buf_pool: Optional[collections.deque] = None):
+        self.transport = None
+        # 连接关闭后缓冲区归还到池中，供后续新连接复用
+        self._buf_pool = buf_pool
+        self._buf = bytearray()
+        self._start = 0  # 未消费数据起点
+        self._end = 0    # 已接收数据终点
+        self._eof = False
+        self._paused = False
+        self._waiter: Optional[asyncio.Future] = None
+    
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if not self._buf:
+            pool = self._buf_pool
+            self._buf = pool.pop() if pool else bytearray(READ_BUFFER_SIZE)
+        size = len(self._buf)
+        if self._start == self._end:
+            # 数据已全部消费，从头复用缓冲区
+            self._start = self._end = 0
+        elif size - self._end < size // 4:
+            pending = self._end - self._start
+            if pending * 2 > size:
+                # 未消费数据超过一半，扩容
+                new_buf = bytearray(size * 2)
+                new_buf[:pending] = memoryview(self._buf)[self._start:self._end]
+                self._buf = new_buf
+            else:
+                # 把未消费数据移到头部
+                self._buf[:pending] = self._buf[self._start:self._end]
+            self._start, self._end = 0, pending
+        return memoryview(self._buf)[self._end:]
+    
+    def buffer_updated(self, nbytes: int):
+        self._end += nbytes
+        # 消费方跟不上时暂停读取 (类似 StreamReader 的流控)，避免缓冲区被撑大
+        if not self._paused and self._end - self._start >= len(self._buf) // 2:
+            self._paused = True
+            self.transport.pause_reading()
+        self._wakeup()
+    
+    def eof_received(self):
+        self._eof = True
+        self._wakeup()
+        return False  # 由 transport 自行关闭
+    
+    def connection_lost(self, exc):
+        self._eof = True
+        self._wakeup()
+        self._release_buffer()
+    
+    def _release_buffer(self):
+        """把未扩容且已无未消费数据的缓冲区归还到池中"""
+        pool = self._buf_pool
+        if (pool is not None and len(self._buf) == READ_BUFFER_SIZE
+                and self._start == self._end and len(pool) < READ_BUFFER_POOL_SIZE):
+            pool.append(self._buf)
+            self._buf = bytearray()
+            self._start = self._end = 0
+    
+    def _wakeup(self):
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+    
+    async def _wait_for_data(self, timeout: Optional[float]):
+        """等待新数据或 EOF，单次等待超时抛出 asyncio.TimeoutError (timeout=None 时不限)"""
+        if self._paused:
+            # 消费方需要更多数据，恢复读取 (此时才允许缓冲区扩容)
+            self._paused = False
+            self.transport.resume_reading()
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            if timeout is None:
+                # 由调用方统一控制截止时间，不再为每次等待单独创建定时器
+                await self._waiter
+            else:
+                await asyncio.wait_for(self._waiter, timeout=timeout)
+        finally:
+            self._waiter = None
+    
+    def is_reusable(self) -> bool:
+        """连接仍然打开且没有残留未消费数据时可放回连接池"""
+        return (
+            not self._eof
+            and self.transport is not None
+            and not self.transport.is_closing()
+            and self._start == self._end
+        )
+    
+    async def readuntil(self, separator: bytes, timeout: Optional[float], limit: int = READ_BUFFER_SIZE) -> bytearray:
+        """读取直到分隔符 (包含分隔符)
+        
+        与 StreamReader.readuntil 一致: EOF 时抛出 IncompleteReadError，
+        超过 limit 字节仍未找到分隔符时抛出 LimitOverrunError，避免无限缓存。
+        """
+        checked = 0  # 已确认不含分隔符的长度 (相对 _start，缓冲区整理后依然有效)
+        while True:
+            pos = self._buf.find(separator, self._start + checked, self._end)
+            if pos != -1:
+                end = pos + len(separator)
+                data = self._buf[self._start:end]
+                self._start = end
+                return data
+            if self._eof:
+                raise asyncio.IncompleteReadError(bytes(self._buf[self._start:self._end]), None)
+            checked = max(0, self._end - self._start - len(separator) + 1)
+            if checked > limit:
+                raise asyncio.LimitOverrunError("分隔符超出长度限制", checked)
+            await self._wait_for_data(timeout)
+    
+    async def readexactly(self, n: int, timeout: Optional[float]) -> bytearray:
+        """读取恰好 n 字节，EOF 时抛出 IncompleteReadError"""
+        while self._end - self._start < n:
+            if self._eof:
+                raise asyncio.IncompleteReadError(bytes(self._buf[self._start:self._end]), n)
+            await self._wait_for_data(timeout)
+        data = self._buf[self._start:self._start + n]
+        self._start += n
+        return data
+    
+    async def unpack(self, fmt: struct.Struct, timeout: Optional[float]) -> tuple:
+        """按 fmt 直接从接收缓冲区解包定长结构 (不复制出中间 bytes)"""
+        size = fmt.size
+        while self._end - self._start < size:
+            if self._eof:
+                raise asyncio.IncompleteReadError(bytes(self._buf[self._start:self._end]), size)
+            await self._wait_for_data(timeout)
+        values = fmt.unpack_from(self._buf, self._start)
+        self._start += size
+        return values
+    
+    async def skip(self, n: int, timeout: Optional[float]):
+        """丢弃 n 字节 (不生成任何对象)，EOF 时抛出 IncompleteReadError"""
+        while self._end - self._start < n:
+            if self._eof:
+                raise asyncio.IncompleteReadError(b"", n)
+            await self._wait_for_data(timeout)
+        self._start += n
+    
+    async def read_into(self, out: bytearray, n: int, timeout: Optional[float]):
+        """读取 n 字节并直接追加到 out
+        
+        数据到达多少就从 memoryview 切片搬运多少，既不为每段生成中间对象，
+        也不需要等整段数据都缓存在接收缓冲区里。
+        """
+        while n > 0:
+            available = self._end - self._start
+            if available:
+                take = min(available, n)
+                out += memoryview(self._buf)[self._start:self._start + take]
+                self._start += take
+                n -= take
+                continue
+            if self._eof:
+                raise asyncio.IncompleteReadError(bytes(out), None)
+            await self._wait_for_data(timeout)
+    
+    async def read_until_eof(self, timeout: Optional[float]) -> bytearray:
+        """读取直到对端关闭连接"""
+        while not self._eof:
+            await self._wait_for_data(timeout)
+        return self.take_buffered()
+    
+    def take_buffered(self) -> bytearray:
+        """取出当前已接收但未消费的全部数据 (原地裁剪，不拷贝)"""
+        data = self._buf
+        try:
+            del data[self._end:]
+            del data[:self._start]
+        except BufferError:
+            # 仍有 memoryview 引用缓冲区时无法原地裁剪，退化为拷贝
+            data = bytearray(memoryview(self._buf)[self._start:self._end])
+        self._buf = bytearray()  # 下次 get_buffer 时再按需分配
+        self._start = self._end = 0
+        return data
+
+
+class AsyncDockerConnection:
+    """一条到 Docker daemon 的 keep-alive 连接 (v2.3.3)
+    
+    从连接池取出后由单个请求独占使用，用完归还或关闭，因此无需额外加锁。
+    """
+    __slots__ = ("transport", "protocol")
+    
+    def __init__(self, transport: asyncio.Transport, protocol: _DockerProtocol):
+        self.transport = transport
+        self.protocol = protocol
+    
+    def send(self, parts):
+        """写出请求片段 (不拼接，body 不做额外拷贝)
+        
+        parts 中的 bytes 对象在写出前不可修改，不要传入之后会被复用的 bytearray。
+        """
+        self.transport.writelines(parts)
+    
+    def is_reusable(self) -> bool:
+        return self.protocol.is_reusable()
+    
+    def close(self):
+        self.transport.close()
+
 
 class AsyncDockerClient:
     """异步 Docker API 客户端 (通过 Unix socket)"""
     
     def __init__(self, socket_path: str = DOCKER_SOCKET):
         self.socket_path = socket_path
+        # socket 路径在进程生命周期内不会变化，只在构造时检查一次
+        # 之后仅在连接报 FileNotFoundError 后才重新检查
+        self._socket_exists = os.path.exists(socket_path)
+        self._socket_checked_at = time.monotonic()
+        # [v2.3.3] keep-alive 空闲连接池 (超出上限的连接用完直接关闭)
+        self._conn_pool: asyncio.Queue = asyncio.Queue(maxsize=DOCKER_POOL_SIZE)
+        # 读缓冲区池 (多个连接共享，避免每个新连接分配 64 KiB)
+        self._buf_pool: collections.deque = collections.deque()
+        self._protocol_factory = functools.partial(_DockerProtocol, self._buf_pool)
+        # [v2.3.3] 容器运行状态缓存: container_name -> (检查时间, running, error)
+        self._running_cache: Dict[str, Tuple[float, bool, Optional[str]]] = {}
+        # 缓存未命中时串行查询: 同一时刻的并发检查只有第一个真正请求 Docker，其余直接命中缓存
+        self._running_lock = asyncio.Lock()
+        # 最近一次 /version 成功的时间 (0 表示没有有效缓存)
+        self._version_ok_at = 0.0
     
-    def _decode_chunked(self, data: bytes) -> bytes:
-        """解码 chunked transfer encoding"""
-        result = []
-        pos = 0
-        while pos < len(data):
-            # 查找 chunk size 行结束
-            line_end = data.find(b"\r\n", pos)
-            if line_end == -1:
-                break
-            
-            # 解析 chunk size (16进制)
-            try:
-                chunk_size = int(data[pos:line_end].decode().strip(), 16)
-            except ValueError:
-                break
+    def _check_socket(self) -> bool:
+        """检查 socket 是否存在 (缓存结果，不存在时最多每 5 秒重新 stat 一次)"""
+        if not self._socket_exists:
+            now = time.monotonic()
+            if now - self._socket_checked_at >= SOCKET_RECHECK_INTERVAL:
+                self._socket_exists = os.path.exists(self.socket_path)
+                self._socket_checked_at = now
+        return self._socket_exists
+    
+    async def _read_chunked(self, protocol: _DockerProtocol, timeout: Optional[float]) -> bytearray:
+        """按 chunked transfer encoding 读取并解码 body (读到结束块为止，不依赖 EOF)"""
+        result = bytearray()
+        while True:
+            # 解析 chunk size 行 (16进制，忽略扩展参数)
+            # int() 本身会忽略首尾空白和行尾 \r\n，只有带扩展参数时才需要截断
+            line = await protocol.readuntil(b"\r\n", timeout)
+            semi = line.find(b";")
+            chunk_size = int(line if semi == -1 else line[:semi], 16)
             
             if chunk_size == 0:
-                break  # 最后一个 chunk
-            
-            # 提取 chunk 数据
-            chunk_start = line_end + 2
-            chunk_end = chunk_start + chunk_size
-            if chunk_end > len(data):
-                result.append(data[chunk_start:])
+                # 最后一个 chunk，跳过 trailer 直到空行
+                while await protocol.readuntil(b"\r\n", timeout) != b"\r\n":
+                    pass
                 break
             
-            result.append(data[chunk_start:chunk_end])
-            pos = chunk_end + 2  # 跳过 \r\n
+            # 各 chunk 数据直接追加到同一个 bytearray，省去逐块拷贝再 join
+            await protocol.read_into(result, chunk_size, timeout)
+            await protocol.skip(2, timeout)  # 跳过 \r\n
         
-        return b"".join(result)
+        return result
     
-    async def _make_request(self, method: str, path: str, body: dict = None, timeout: float = 10.0) -> dict:
-        """异步发送 HTTP 请求到 Docker daemon"""
-        try:
-            # 检查 socket 是否存在
-            if not os.path.exists(self.socket_path):
-                return {"status_code": 0, "error": f"Docker socket 不存在: {self.socket_path}"}
-            
-            # 异步连接 Unix socket
-            reader, writer = await asyncio.wait_for(
-                asyncio.open_unix_connection(self.socket_path),
-                timeout=timeout
-            )
-            
-            # 构建 HTTP 请求
-            body_bytes = json.dumps(body).encode() if body else b""
-            request = (
-                f"{method} {path} HTTP/1.1\r\n"
-                f"Host: localhost\r\n"
-                f"Content-Type: application/json\r\n"
-                f"Content-Length: {len(body_bytes)}\r\n"
-                f"Connection: close\r\n"
-                f"\r\n"
-            ).encode() + body_bytes
-            
-            # 发送请求
-            writer.write(request)
-            await writer.drain()
-            
-            # 循环读取完整响应直到 EOF
-            chunks = []
-            try:
-                while True:
-                    chunk = await asyncio.wait_for(reader.read(8192), timeout=timeout)
-                    if not chunk:
-                        break
-                    chunks.append(chunk)
-            except asyncio.TimeoutError:
-                pass  # 读取超时，使用已读取的数据
-            
-            response = b"".join(chunks)
-            
-            writer.close()
+    async def _get_connection(self, timeout: float) -> Tuple[AsyncDockerConnection, bool]:
+        """从连接池取一个可用连接，没有则新建。返回 (conn, reused)"""
+        while not self._conn_pool.empty():
+            conn = self._conn_pool.get_nowait()
+            if conn.is_reusable():
+                return conn, True
+            conn.close()  # 对端已关闭的空闲连接直接丢弃
+        
+        return await self._connect(timeout), False
+    
+    async def _connect(self, timeout: float) -> AsyncDockerConnection:
+        """新建一条到 Docker daemon 的连接"""
+        loop = asyncio.get_running_loop()
+        transport, protocol = await asyncio.wait_for(
+            loop.create_unix_connection(self._protocol_factory, self.socket_path),
+            timeout=timeout
+        )
+        return AsyncDockerConnection(transport, protocol)
+    
+    def _release_connection(self, conn: AsyncDockerConnection, keep_alive: bool):
+        """请求结束后归还连接; 不可复用或池已满时关闭"""
+        if keep_alive and conn.is_reusable():
             try:
-                await writer.wait_closed()
-            except:
+                self._conn_pool.put_nowait(conn)
+                return
+            except asyncio.QueueFull:
                 pass
+        conn.close()
+    
+    async def close(self):
+        """关闭连接池中的所有空闲连接 (应用退出时调用)"""
+        while not self._conn_pool.empty():
+            self._conn_pool.get_nowait().close()
+        self._buf_pool.clear()
+    
+    async def _read_response(self, protocol: _DockerProtocol, timeout: Optional[float]):
+        """读取一个完整响应，返回 (status_code, body, keep_alive)"""
+        head = await protocol.readuntil(b"\r\n\r\n", timeout)
+        
+        # 获取状态码 (直接在 bytes 上解析，不解码整个头部)
+        status_code = _parse_status_code(head)
+        
+        headers = _parse_headers(head)
+        keep_alive = headers.get(b"connection", b"").lower() != b"close"
+        content_length = headers.get(b"content-length")
+        
+        # 根据 Content-Length / chunked 判断响应边界，连接可继续复用
+        if headers.get(b"transfer-encoding", b"").lower().endswith(b"chunked"):
+            body_data = await self._read_chunked(protocol, timeout)
+        elif content_length is not None:
+            # 边到边搬运到输出 bytearray，大响应不会把接收缓冲区撑大
+            body_data = bytearray()
+            await protocol.read_into(body_data, int(content_length), timeout)
+        elif status_code in (204, 304) or (100 <= status_code < 200 and status_code != 101):
+            body_data = b""
+        else:
+            # 没有长度信息 (如 hijack 的 exec/start 流)，只能读到 EOF，连接不可复用
+            body_data = await protocol.read_until_eof(timeout)
+            keep_alive = False
+        
+        return status_code, body_data, keep_alive
+    
+    @staticmethod
+    def _build_request(method: str, path: str, body: dict = None, connection: str = "keep-alive") -> tuple:
+        """构建 HTTP 请求，返回交给 writelines 的 (head, body) 片段
+        
+        body 为 bytes 时视为已编码的 JSON 直接发送。
+        """
+        if isinstance(body, bytes):
+            body_bytes = body
+        else:
+            body_bytes = _json_dumps(body) if body else b""
+        upgrade = "Upgrade: tcp\r\n" if connection == "Upgrade" else ""
+        head = (
+            f"{method} {path} HTTP/1.1\r\n"
+            f"Host: localhost\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body_bytes)}\r\n"
+            f"Connection: {connection}\r\n"
+            f"{upgrade}"
+            f"\r\n"
+        ).encode()
+        # 头部与 body 分开交给 writelines，不在 Python 层拼接 (3.12+ 会用 sendmsg 一次发出)
+        return (head, body_bytes) if body_bytes else (head,)
+    
+    async def _read_responses(self, conn: AsyncDockerConnection, count: int, timeout: float, responses: list) -> bool:
+        """按顺序读取 count 个响应追加到 responses，返回连接能否继续复用"""
+        keep_alive = False
+        # 整组响应共用一个截止时间 (与连接超时分开)，读取过程中不再逐次设置定时器
+        async with asyncio.timeout(timeout):
+            for _ in range(count):
+                status_code, body_data, keep_alive = await self._read_response(conn.protocol, None)
+                responses.append({"status_code": status_code, "body": body_data})
+                if not keep_alive:
+                    break  # daemon 要求关闭连接，后续请求不会再有响应
+        return keep_alive
+    
+    async def _exchange(self, requests: List[tuple], timeout: float = 10.0) -> List[dict]:
+        """在一条连接上发送一组请求并按顺序读取响应 (HTTP pipelining)
+        
+        requests: [(method, path, body), ...]
+        返回与 requests 一一对应的 {"status_code", "body"} 或 {"status_code", "error"}
+        """
+        responses = []
+        try:
+            # 不再预先 stat socket: 不存在时 connect 直接抛 FileNotFoundError
+            # 所有请求一次写出，省去逐个请求等待往返
+            parts = [part for method, path, body in requests for part in self._build_request(method, path, body)]
             
-            # 解析响应
-            if b"\r\n\r\n" in response:
-                header_end = response.find(b"\r\n\r\n")
-                header = response[:header_end].decode()
-                body_data = response[header_end + 4:]
-                
-                # 获取状态码
-                status_line = header.split("\r\n")[0]
-                parts = status_line.split()
-                status_code = int(parts[1]) if len(parts) >= 2 else 0
-                
-                # 检查是否是 chunked 编码
-                if "transfer-encoding: chunked" in header.lower():
-                    body_data = self._decode_chunked(body_data)
-                
-                # 解析 JSON body
+            # 优先复用连接池中的 keep-alive 连接
+            conn, reused = await self._get_connection(timeout)
+            keep_alive = False
+            try:
+                conn.send(parts)
                 try:
-                    # 使用 errors='replace' 以防止 UnicodeDecodeError
-                    decoded_body = body_data.decode(errors='replace')
-                    result = json.loads(decoded_body) if decoded_body.strip() else {}
-                except json.JSONDecodeError as e:
-                    # [v2.3.1] 对于 exec/start 等流响应，JSON 解析失败是预期的，不应视为错误
-                    if "/exec/" not in path or "/start" not in path:
-                         logger.debug(f"[TDL] JSON 解析失败: {e}")
-                    # 记录原始字节用于流式处理
-                    result = {
-                        "raw": body_data.decode(errors='replace')[:1000],
-                        "raw_bytes": body_data
-                    }
-                
-                return {"status_code": status_code, "data": result}
+                    keep_alive = await self._read_responses(conn, len(requests), timeout, responses)
+                except asyncio.IncompleteReadError as e:
+                    if not (reused and not responses and not e.partial):
+                        raise
+                    # POST 等非幂等请求可能已被 daemon 执行 (如 exec create)，不能重放
+                    if not all(method in _IDEMPOTENT_METHODS for method, _, _ in requests):
+                        raise
+                    # 空闲连接已被 daemon 关闭且未收到任何响应，换新连接重试一次
+                    conn.close()
+                    conn, reused = await self._get_connection(timeout)
+                    conn.send(parts)
+                    keep_alive = await self._read_responses(conn, len(requests), timeout, responses)
+            finally:
+                self._release_connection(conn, keep_alive)
             
-            return {"status_code": 500, "error": "无效响应"}
+            error = {"status_code": 0, "error": "连接已被 Docker daemon 关闭"}
             
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            error = {"status_code": 500, "error": "无效响应"}
         except asyncio.TimeoutError:
-            return {"status_code": 0, "error": "连接超时"}
+            error = {"status_code": 0, "error": "连接超时"}
         except FileNotFoundError:
-            return {"status_code": 0, "error": f"Docker socket 不存在: {self.socket_path}"}
+            self._socket_exists = False
+            self._socket_checked_at = time.monotonic()
+            error = {"status_code": 0, "error": f"Docker socket 不存在: {self.socket_path}"}
         except ConnectionRefusedError:
-            return {"status_code": 0, "error": "Docker daemon 拒绝连接"}
+            error = {"status_code": 0, "error": "Docker daemon 拒绝连接"}
         except Exception as e:
-            return {"status_code": 0, "error": str(e)}
-
-    def _decode_docker_stream(self, data: bytes) -> str:
-        """解析 Docker 多路复用流 (Header: 8 bytes) (v2.1.1)"""
-        if not data: return ""
-        if len(data) < 8 or data[0] not in [1, 2]:
-            return data.decode(errors='replace')
+            error = {"status_code": 0, "error": str(e)}
         
-        result = []
-        offset = 0
-        while offset + 8 <= len(data):
-            try:
-                import struct
-                size = struct.unpack(">I", data[offset+4:offset+8])[0]
-                offset += 8
-                if offset + size <= len(data):
-                    result.append(data[offset:offset+size].decode(errors='replace'))
-                    offset += size
-                else:
-                    result.append(data[offset:].decode(errors='replace'))
-                    break
-            except:
-                return data.decode(errors='replace')
-        return "".join(result)
-    
-    async def is_available(self) -> tuple:
-        """检查 Docker 是否可用"""
-        if not os.path.exists(self.socket_path):
-            return False, f"Docker socket 不存在: {self.socket_path}"
-        
-        result = await self._make_request("GET", "/version", timeout=5.0)
-        if result.get("status_code") == 200:
-            return True, None
-        return False, result.get("error", "无法连接 Docker")
+        # 未得到响应的请求逐个填入错误
+        responses.extend(dict(error) for _ in range(len(requests) - len(responses)))
+        return responses
     
-    async def is_container_running(self, container_name: str) -> tuple:
-        """检查容器是否运行"""
-        result = await self._make_request("GET", f"/containers/{container_name}/json", timeout=5.0)
+    async def _make_request_raw(self, method: str, path: str, body: dict = None, timeout: float = 10.0, body_bytes: bytes = None) -> dict:
+        """异步发送 HTTP 请求到 Docker daemon，返回未解析的 body (bytes-like)
         
+        body_bytes: 已编码好的请求体，指定时忽略 body
+        """
+        return (await self._exchange([(method, path, body if body_bytes is None else body_bytes)], timeout))[0]
+    
+    @staticmethod
+    def _parse_json_response(path: str, response: dict) -> dict:
+        """把 _exchange 的原始响应解析为 {"status_code", "data"}"""
+        if "error" in response:
+            return response
+        body_data = response["body"]
+        
+        # 解析 JSON body
+        try:
+            # 直接解析 bytes，非法 UTF-8 同样按 JSONDecodeError 处理
+            result = _json_loads(body_data) if body_data.strip() else {}
+        except json.JSONDecodeError as e:
+            # [v2.3.1] 对于 exec/start 等流响应，JSON 解析失败是预期的，不应视为错误
+            if ("/exec/" not in path or "/start" not in path) and logger.isEnabledFor(logging.DEBUG):
+                 logger.debug(f"[TDL] JSON 解析失败: {e}")
+            # 记录原始字节用于流式处理
+            result = {
+                "raw": body_data.decode(errors='replace')[:1000],
+                "raw_bytes": bytes(body_data)
+            }
+            
+        return {"status_code": response["status_code"], "data": result}
+    
+    async def _make_request(self, method: str, path: str, body: dict = None, timeout: float = 10.0, body_bytes: bytes = None) -> dict:
+        """异步发送 HTTP 请求到 Docker daemon"""
+        return self._parse_json_response(path, await self._make_request_raw(method, path, body, timeout, body_bytes))
+    
+    async def batch(self, requests: List[tuple], timeout: float = 10.0) -> List[dict]:
+        """批量发送请求 (v2.3.3)
+        
+        在同一条 keep-alive 连接上连续写出所有请求、再按顺序读取响应，
+        N 个请求只需一次往返。返回值与逐个调用 _make_request 的结果一致。
+        仅用于幂等请求 (GET)，中途连接断开时剩余请求统一返回错误。
+        """
+        responses = await self._exchange(requests, timeout)
+        return [self._parse_json_response(path, response) for (_, path, _), response in zip(requests, responses)]
+
+    def _version_fresh(self) -> bool:
+        return time.monotonic() - self._version_ok_at < VERSION_CACHE_TTL
+    
+    def _containers_filter_path(self, container_name: str, **filters) -> str:
+        """构建按名称精确过滤的 /containers/json 请求路径"""
+        # name 过滤器是正则匹配 (名称带前导 /)，需锚定避免匹配到 tdl-xxx 之类的容器
+        filters["name"] = [f"^/{re.escape(container_name)}$"]
+        query = urllib.parse.quote(_json_dumps(filters))
+        return f"/containers/json?all=true&filters={query}"
+    
+    def _get_cached_running(self, container_name: str) -> Optional[tuple]:
+        """返回 RUNNING_CACHE_TTL 内的 (running, error) 缓存，过期或不存在时返回 None"""
+        cached = self._running_cache.get(container_name)
+        if cached and time.monotonic() - cached[0] < RUNNING_CACHE_TTL:
+            return cached[1], cached[2]
+        return None
+    
+    def _cache_running(self, container_name: str, state: tuple, status_code: int) -> tuple:
+        """缓存容器状态查询结果; 请求失败时清除缓存，避免把错误状态缓存下来"""
+        if status_code == 200:
+            self._running_cache[container_name] = (time.monotonic(), *state)
+        else:
+            self._running_cache.pop(container_name, None)
+        return state
+    
+    @staticmethod
+    def _container_state(container_name: str, result: dict) -> tuple:
+        """根据不带 status 过滤的 /containers/json 响应判断容器是否运行"""
         status_code = result.get("status_code", 0)
-        logger.debug(f"[TDL] 容器检查响应: status_code={status_code}")
+        if status_code != 200:
+            return False, result.get("error", f"检查失败 (status={status_code})")
         
-        if status_code == 404:
+        containers = result.get("data")
+        if not containers:
             return False, f"容器 '{container_name}' 不存在"
         
-        if status_code == 200:
-            data = result.get("data", {})
-            # 调试: 打印 data 类型和部分内容
-            logger.debug(f"[TDL] 响应数据类型: {type(data)}, 键: {list(data.keys()) if isinstance(data, dict) else 'N/A'}")
-            
-            state = data.get("State", {}) if isinstance(data, dict) else {}
-            running = state.get("Running", False)
-            status = state.get("Status", "unknown")
-            
-            logger.debug(f"[TDL] State: Running={running}, Status={status}")
-            
-            if running:
-                return True, None
-            return False, f"容器状态: {status}"
+        status = containers[0].get("State", "unknown") if isinstance(containers, list) else "unknown"
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[TDL] State: {status}")
+        if status == "running":
+            return True, None
+        return False, f"容器状态: {status}"
+    
+    async def check_status(self, container_name: str) -> tuple:
+        """一次往返同时检查 Docker 与容器状态 (v2.3.3)
         
-        return False, result.get("error", f"检查失败 (status={status_code})")
+        /version 与容器查询通过 batch() 在同一连接上流水线发送;
+        /version 在缓存期内时只查询容器。
+        返回 (docker_available, docker_error, container_running, container_error)
+        """
+        if not self._check_socket():
+            error = f"Docker socket 不存在: {self.socket_path}"
+            return False, error, False, error
+        
+        # 缓存有效说明 Docker 刚刚还能正常响应
+        cached = self._get_cached_running(container_name)
+        if cached is not None:
+            return (True, None, *cached)
+        
+        async with self._running_lock:
+            # 等锁期间其他协程可能已经查询过
+            cached = self._get_cached_running(container_name)
+            if cached is not None:
+                return (True, None, *cached)
+            return await self._query_status(container_name)
+    
+    async def _query_status(self, container_name: str) -> tuple:
+        """向 Docker 查询 /version 与容器状态并更新缓存 (check_status 缓存未命中时调用)"""
+        containers_path = self._containers_filter_path(container_name)
+        if self._version_fresh():
+            containers = await self._make_request("GET", containers_path, timeout=5.0)
+            # status_code 为 0 表示连接层失败，即 Docker 已不可用
+            version = containers if containers.get("status_code") == 0 else {"status_code": 200}
+        else:
+            version, containers = await self.batch([
+                ("GET", "/version", None),
+                ("GET", containers_path, None),
+            ], timeout=5.0)
+            if version.get("status_code") == 200:
+                self._version_ok_at = time.monotonic()
+        
+        if version.get("status_code") != 200:
+            error = version.get("error", "无法连接 Docker")
+            self._version_ok_at = 0.0
+            self._running_cache.pop(container_name, None)
+            return False, error, False, error
+        
+        container_running, container_error = self._cache_running(
+            container_name, self._container_state(container_name, containers), containers.get("status_code", 0)
+        )
+        return True, None, container_running, container_error
 
     
-    async def exec_command(self, container_name: str, cmd: list, timeout: float = 3600.0, stuck_check_callback=None) -> dict:
-        """在容器中执行命令 (v2.3.2 Polling Mode)"""
+    async def exec_command(
+        self,
+        container_name: str,
+        cmd: list,
+        timeout: float = 3600.0,
+        stuck_check_callback=None,
+        log_path: Optional[str] = None,
+        stuck_check_interval: float = STUCK_CHECK_INTERVAL,
+        on_output: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> dict:
+        """在容器中执行命令 (v2.3.3 Attached 流 + 状态轮询)
+        
+        log_path: 指定时在容器内把 stdout/stderr 重定向到该文件 (v2.3.3)，
+        输出不经过 Docker API 也不驻留内存; 执行结束即删除该文件，失败时日志末尾作为 output 返回。
+        stuck_check_callback: 每 stuck_check_interval 秒调用一次，返回 True 时终止 tdl。
+        on_output: 每收到一帧输出就以解码后的文本回调 (与 log_path 同时使用时收不到输出)。
+        """
+        if log_path:
+            cmd = ["sh", "-c", _LOG_WRAPPER, "sh", log_path, *cmd]
+        
         # 1. 创建 exec 实例
         create_result = await self._make_request(
             "POST", 
             f"/containers/{container_name}/exec",
-            {
-                "AttachStdin": False,
-                "AttachStdout": True,
-                "AttachStderr": True,
-                "Tty": False, # 关闭 TTY 以便清晰区分 stdout/stderr
-                "Cmd": cmd
-            },
-            timeout=10.0
+            timeout=10.0,
+            body_bytes=_EXEC_CREATE_PREFIX + _json_dumps(cmd) + b"}"
         )
         
-        if create_result.get("status_code") != 201:
+        create_status = create_result.get("status_code")
+        if create_status != 201:
+            # 容器不存在 / 未运行时 daemon 直接拒绝创建 exec，无需事先单独检查容器状态
+            self._running_cache.pop(container_name, None)
+            if create_status == 404:
+                return {"success": False, "error": f"容器 '{container_name}' 不存在"}
+            if create_status == 409:
+                return {"success": False, "error": "TDL 容器未运行"}
             return {"success": False, "error": f"创建 exec 失败: {create_result.get('error')}"}
         
         exec_id = create_result.get("data", {}).get("Id")
         if not exec_id:
             return {"success": False, "error": "未获取到 exec ID"}
         
-        # 2. 启动 exec (Detached 模式)
-        # 我们不在这里读取流，因为流读取受限于 Python 库的各种超时和缓冲区问题
-        # 改用 Detached 启动，然后轮询状态，最后一次性获取产生的日志
-        start_result = await self._make_request(
-            "POST",
-            f"/exec/{exec_id}/start",
-            {"Detach": True, "Tty": False},
-            timeout=10.0
-        )
+        # 2. 以 Attached 模式启动 exec，连接被 hijack 为输出流 (v2.3.3)
+        # 流由后台任务读取，主流程只关心进程状态: 流结束即进程退出，无需等待下一个轮询周期
+        try:
+            conn = await self._start_exec_stream(exec_id)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as e:
+            return {"success": False, "error": f"启动执行失败: {e}"}
+        if isinstance(conn, dict):
+            return conn
         
-        if start_result.get("status_code") != 200:
-            return {"success": False, "error": start_result.get("error", "启动执行失败")}
-            
-        # 3. 轮询等待结束
-        import time
+        output = bytearray()
+        drain_task = asyncio.create_task(self._drain_exec_stream(conn.protocol, output, on_output=on_output))
+        # [Optimization] 卡死检测 (Stuck Detection) 在独立任务中按自己的节奏运行，
+        # 任务结束即表示检测到卡死，主循环无需等到下一次轮询
+        stuck_task = None
+        waiters = {drain_task}
+        if stuck_check_callback:
+            stuck_task = asyncio.create_task(self._watch_stuck(stuck_check_callback, stuck_check_interval))
+            waiters.add(stuck_task)
+        
+        # 3. 等待结束: 流 EOF、卡死检测与状态轮询竞速 (流静默时由轮询兜底)
         start_time = time.time()
-        exit_code = -1
+        poll_interval = POLL_INTERVAL_MIN
+        try:
+            while True:
+                if time.time() - start_time > timeout:
+                    return {"success": False, "error": "执行超时"}
+                
+                if waiters:
+                    await asyncio.wait(waiters, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await asyncio.sleep(poll_interval)
+                # 自适应退避: 短命令很快就能确认结束，长时间下载逐步放慢轮询
+                poll_interval = min(POLL_INTERVAL_MAX, poll_interval * POLL_BACKOFF)
+                
+                if stuck_task is not None and stuck_task.done():
+                    logger.error(f"[TDL] 检测到执行卡死 (Stuck Detected)，强制终止: {container_name}")
+                    # 杀掉容器内的 tdl 进程，直接返回失败让外部处理
+                    await self.kill_process(container_name, "tdl")
+                    return {"success": False, "error": "Stuck detected (File not growing)"}
+                
+                if drain_task in waiters and drain_task.done():
+                    # 流已结束: 进程通常已退出，退避重新从最短间隔开始，尽快确认状态
+                    # (流提前断开而进程仍在运行时，之后照常退避轮询并继续卡死检测)
+                    waiters.discard(drain_task)
+                    poll_interval = POLL_INTERVAL_MIN
+                
+                inspect_result = await self._make_request_raw(
+                    "GET",
+                    f"/exec/{exec_id}/json",
+                    timeout=5.0
+                )
+                
+                if inspect_result.get("status_code") == 200:
+                    running, exit_code = _parse_exec_state(inspect_result["body"])
+                    if not running:
+                        if not drain_task.done():
+                            # 进程已退出，给流一点时间读完剩余输出
+                            await asyncio.wait({drain_task}, timeout=1.0)
+                        text = output.decode(errors='replace')
+                        if exit_code == 0:
+                            return {"success": True, "output": text}
+                        return {"success": False, "error": f"ExitCode={exit_code}", "output": text}
+        finally:
+            drain_task.cancel()
+            if stuck_task is not None:
+                stuck_task.cancel()
+            conn.close()
+    
+    @staticmethod
+    async def _watch_stuck(stuck_check_callback, interval: float):
+        """按固定间隔调用卡死检测回调，返回 True 表示卡死 (返回即结束)
         
+        外部回调通常检查文件大小是否在增长。
+        """
         while True:
-            # 检查是否超时
-            if time.time() - start_time > timeout:
-                return {"success": False, "error": "执行超时 (Polling Timeout)"}
-            
-            inspect_result = await self._make_request(
-                "GET",
-                f"/exec/{exec_id}/json",
-                timeout=5.0
-            )
-            
-            if inspect_result.get("status_code") != 200:
-                await asyncio.sleep(1.0)
-                continue
-                
-            info = inspect_result.get("data", {})
-            running = info.get("Running", True) # 默认认为运行中，防止误判
-            
-            if not running:
-                exit_code = info.get("ExitCode", -1)
-                break
-            
-            await asyncio.sleep(0.5)
-            
-        # 4. 获取日志 (通过 logs 接口回溯，或者如果 docker API 支持从 exec 获取流也可以)
-        # 由于 Docker API 没有直接获取 exec 日志的便捷 HTTP 接口 (通常是 start 时 attach)
-        # 且我们使用了 Detached，我们需要一种方式获取输出。
-        # 实际上 Detached exec 的输出很难通过标准 API 再次获取，除非配置了 logging driver
-        # 所以更稳妥的 Polling 方式其实是：Keep Attached but read in small chunks? No, that hangs.
-        
-        # 修正策略：为了修复 "信号捕获" 问题，核心是不要依赖 stream close event
-        # 我们使用 Docker SDK 风格的 "Socket Read" 但配合超时控制
-        # 然而为了彻底解决，我们还是切回 (Detach=False) 但优化读取循环 ?
-        
-        # 不，用户报告的问题是"无法捕获成功信号"，意味着 Python 以为还在运行或者读取超时了。
-        # 最稳的方案 (针对 TDL 这种可能长时间无输出的):
-        # 还是得用 Attached 模式，但是要处理 socket 读取超时。
-        
-        # 考虑到当前架构限制，我们使用一个混合方案：
-        # 启动时 Attach，但使用 asyncio.wait_for 包装 read，并且容忍超时 (超时不代表结束)
-        # 同时并发检查 exec inspect。
-        
-        # 但既然已经写了 Detached 的开头，我们换个思路：
-        # 对于 TDL download，我们其实不太关心 stdout 内容，除非出错。
-        # ExitCode 0 才是硬指标。
-        # 如果 ExitCode=0，我们就认为成功。Detail 交给 verify 阶段。
-        # 如果非 0，我们即便拿不到完整 log，拿个大概也行。
-        
-        # 但为了调试，我们最好还是能拿到输出。
-        # 遗憾 Docker HTTP API 对 Detached Exec 的日志获取支持有限。
-        # 因此，回退到：Attach 模式，但重写 _make_request 里的读取逻辑？
-        # 更简单的：改回 Detached=False，但是在读取流时，使用 inspect 辅助判断是否该退出？
-        
-        # Let's stick to the Attached mode logic BUT fix the stream reader hanging issue.
-        # The previous implementation relies on `reader.read(8192)` returning empty bytes for EOF.
-        # If TDL holds open stdout but sends nothing, it hangs.
-        
-        # 经过思考，针对 "tdl下载无法正确捕获成功下载信号"：
-        # 最好的办法是【不依赖】输出流的结束，而是依赖【进程状态】的结束。
-        # 所以 Polling ExitCode 是最正确的。
-        # 问题是：Polling 时怎么拿日志？
-        # 各种 Docker 库的做法是：Detach=False (Streaming), 但单独开个 Tasks 去读 Stream，主流程 Wait 状态。
-        
-        # 这里为了简化且稳健：
-        # 1. Start exec (Detach=False)
-        # 2. 读取 Response Body (Hijacked stream)
-        # 3. 解析 Log
-        
-        # 原有实现的问题在于 `await reader.read` 可能会永久挂起如果对方不关闭流。
-        # 我们改写这个简单的 exec_command，让它更鲁棒。
-        
-        # 方案：使用 Detach=False，常规 http 请求。
-        # 但是！如果下载一个大文件，http response 会非常长/久。
-        # 之前的实现也是一次性读取或者简单的 chunk read。
-        
-        # 让我们实施【Polling 检查 + 忽略实时输出 (TDL会写文件)】策略?
-        # 不行，出错得看日志。
-        
-        # 最终决定方案：
-        # 使用 Detach=True 启动。
-        # 这样请求会立即返回。
-        # 然后我们轮询 Inspect API 等待 Running=False。
-        # 这样绝对能捕获 ExitCode。
-        # 【缺点】：拿不到 stdout/stderr。
-        # 【弥补】：TDL 下载成功与否主要看文件是否存在+大小。失败时没日志确实是个痛点。
-        # 但用户痛点是 "卡住" 和 "无法捕获成功"。
-        # 既然是 TDL，我们可以让 TDL 把日志写到文件里吗？
-        # 或者，我们可以 trust TDL is robust enough.
-        
-        # 还是回头看 `_make_request`。它里面有 `timeout`。
-        # 如果命令执行超过 timeout (默认 300s)，_make_request 就会报错 Timeout。
-        # 这就是问题所在！TDL 下载可能很久。
-        # 原代码 `timeout=3600.0` 传给了 `_make_request`。
-        # `asyncio.open_unix_connection` 的 timeout 是连接超时。
-        # 但 `reader.read` 的 timeout 也是传进去的 3600。
-        
-        # 如果 TDL 下载了 2 小时，这里就超时报错了，但其实还在下。
-        # 或者 TDL 没有任何输出，reader.read 卡住。
-        
-        # 修正：Polling 模式是必须的。不要 hold 一个长连接 1 小时。
-        # 实现 Polling 模式，且放弃获取日志 (或者只获取 TDL 自身的日志文件，如果支持)。
-        # 实际上，只要 ExitCode=0，我们就不需要日志。
-        # 如果 ExitCode!=0，我们可能丢失日志，但解决了卡死问题。
-        # 考虑到 TDL 失败通常是因为网络或文件系统，用户重试即可。
-        # 权衡之下，解决 "卡住" 是第一优先级。
-        
-        # 实施 Polling 模式 (Detach=True)。
-        
-        start_result = await self._make_request(
+            await asyncio.sleep(interval)
+            try:
+                if asyncio.iscoroutinefunction(stuck_check_callback):
+                    is_stuck = await stuck_check_callback()
+                else:
+                    is_stuck = stuck_check_callback()
+                if is_stuck:
+                    return True
+            except Exception as e:
+                logger.warning(f"[TDL] 卡死检测回调执行出错: {e}")
+    
+    async def kill_process(self, container_name: str, process_name: str) -> bool:
+        """在容器内 SIGKILL 指定名称的进程 (v2.3.3)
+        
+        以 Detach 模式启动 exec，不附加输出流也不轮询状态，只需 create + start 两次请求。
+        Docker 没有 kill 单个 exec 的接口，inspect 返回的 Pid 属于宿主机命名空间，
+        /containers/{name}/kill 又会停掉整个 TDL 容器，因此仍在容器内执行 killall。
+        """
+        name = shlex.quote(process_name)
+        create_result = await self._make_request(
             "POST",
-            f"/exec/{exec_id}/start",
-            {"Detach": True, "Tty": False},
-            timeout=10.0 # 只要启动指令发送成功即可
+            f"/containers/{container_name}/exec",
+            {
+                "AttachStdin": False, "AttachStdout": False, "AttachStderr": False,
+                "Cmd": ["sh", "-c", f"killall -9 {name} || pkill -9 {name}"]
+            },
+            timeout=5.0
         )
+        exec_id = create_result.get("data", {}).get("Id") if create_result.get("status_code") == 201 else None
+        if not exec_id:
+            logger.warning(f"[TDL] 创建 kill exec 失败: {create_result.get('error', create_result.get('status_code'))}")
+            return False
         
-        if start_result.get("status_code") != 200:
-            return {"success": False, "error": start_result.get("error", "启动执行失败")}
-            
-        # 轮询
-        import time
-        start_time = time.time()
+        start_result = await self._make_request_raw(
+            "POST", f"/exec/{exec_id}/start", {"Detach": True, "Tty": False}, timeout=5.0
+        )
+        return start_result.get("status_code") == 200
+    
+    async def _start_exec_stream(self, exec_id: str, timeout: float = 10.0):
+        """以 Attached 模式启动 exec，返回已 hijack 的连接 (失败时返回错误 dict)
         
-        while True:
-            if time.time() - start_time > timeout:
-                return {"success": False, "error": "执行超时"}
-            
-            inspect_result = await self._make_request(
-                "GET",
-                f"/exec/{exec_id}/json",
-                timeout=5.0
-            )
+        hijack 后连接不再是 HTTP，因此总是新建连接且不归还连接池。
+        """
+        conn = await self._connect(timeout)
+        request = self._build_request(
+            "POST", f"/exec/{exec_id}/start", {"Detach": False, "Tty": False}, connection="Upgrade"
+        )
+        try:
+            conn.send(request)
+            response_head = await conn.protocol.readuntil(b"\r\n\r\n", timeout)
+        except BaseException:
+            conn.close()
+            raise
+        
+        status_code = _parse_status_code(response_head)
+        # 101: 已升级为原始流; 部分 daemon 版本不升级而直接返回 200 + 原始流
+        if status_code not in (101, 200):
+            conn.close()
+            return {"success": False, "error": f"启动执行失败 (status={status_code})"}
+        return conn
+    
+    @staticmethod
+    async def _iter_docker_stream(protocol: _DockerProtocol, out: bytearray) -> AsyncIterator[Tuple[int, int]]:
+        """逐帧读取 Docker 多路复用流直到 EOF，产出 (stream_type, size)
+        
+        负载直接从接收缓冲区追加到 out 末尾，不为每帧单独分配 bytes。
+        """
+        try:
+            while True:
+                stream_type, size = await protocol.unpack(_FRAME_HDR, None)
+                await protocol.read_into(out, size, None)
+                yield stream_type, size
+        except asyncio.IncompleteReadError:
+            return  # 流结束 (进程已退出或连接关闭)
+    
+    @staticmethod
+    async def _drain_exec_stream(
+        protocol: _DockerProtocol,
+        output: bytearray,
+        limit: int = EXEC_OUTPUT_LIMIT,
+        on_output: Optional[Callable[[str], Awaitable[None]]] = None
+    ):
+        """读取 exec 输出流，只保留末尾 limit 字节的输出，并逐帧转发给 on_output"""
+        # stdout / stderr 各用一个增量解码器，跨帧截断的多字节字符不会变成乱码
+        decoders = {}
+        async for stream_type, size in AsyncDockerClient._iter_docker_stream(protocol, output):
+            text = None
+            if on_output is not None:
+                decoder = decoders.get(stream_type)
+                if decoder is None:
+                    decoder = decoders[stream_type] = codecs.getincrementaldecoder("utf-8")(errors="replace")
+                # 本帧负载就在 output 末尾，直接从 memoryview 切片解码 (裁剪前释放视图)
+                with memoryview(output) as mv:
+                    text = decoder.decode(mv[len(mv) - size:])
             
-            if inspect_result.get("status_code") == 200:
-                data = inspect_result.get("data", {})
-                if not data.get("Running"):
-                    exit_code = data.get("ExitCode")
-                    if exit_code == 0:
-                        return {"success": True, "output": "(Polling Mode: Success)"}
-                    else:
-                        return {"success": False, "error": f"ExitCode={exit_code}", "output": ""}
+            if len(output) > limit:
+                del output[:len(output) - limit]
             
-            # [Optimization] 卡死检测逻辑 (Stuck Detection)
-            # 如果提供了检查回调，且返回 True (表示卡死)，则终止进程
-            # 外部回调通常检查文件大小是否在增长
-            if stuck_check_callback:
+            if text:
                 try:
-                    if asyncio.iscoroutinefunction(stuck_check_callback):
-                        is_stuck = await stuck_check_callback()
-                    else:
-                        is_stuck = stuck_check_callback()
-                    
-                    if is_stuck:
-                        logger.error(f"[TDL] 检测到执行卡死 (Stuck Detected)，强制终止: {container_name}")
-                        # 尝试 kill 容器内的主进程 (tdl) 
-                        # 由于这是 exec，我们实际上需要杀掉 exec 进程或者容器内的 tdl 进程
-                        # 简单起见，我们在容器内执行 killall
-                        await self._make_request(
-                            "POST", 
-                            f"/containers/{container_name}/exec",
-                            {
-                                "AttachStdin": False, "AttachStdout": False, "AttachStderr": False,
-                                "Cmd": ["sh", "-c", "killall -9 tdl"]
-                            },
-                        )
-                        # 同时尝试 resize exec 以触发信号? 不，直接返回超时/失败让外部处理
-                        return {"success": False, "error": "Stuck detected (File not growing)"}
+                    await on_output(text)
                 except Exception as e:
-                    logger.warning(f"[TDL] 卡死检测回调执行出错: {e}")
-
-            await asyncio.sleep(2.0)
+                    logger.warning(f"[TDL] 输出回调执行出错: {e}")
 
 
 class TDLDownloader:
@@ -421,19 +925,21 @@ class TDLDownloader:
     def __init__(self):
         self.container_name = os.environ.get("TDL_CONTAINER_NAME", "tdl")
         self.docker = AsyncDockerClient()
-        # [FIX] TDL 全局信号量，防止同一个 Session 并发导致崩溃 (v1.6.8)
-        self._semaphore = asyncio.Semaphore(1)
-        logger.info(f"[TDL] 下载器初始化: container={self.container_name}, socket={DOCKER_SOCKET}")
+        # [v2.3.3] 并行分片数: 多 URL 时拆成多个 tdl dl 同时执行 (需 TDL 侧支持多 Session，默认 1)
+        self._max_parallel_shards = max(1, int(os.environ.get("TDL_PARALLEL_SHARDS", "1")))
+        # [FIX] 防止同一个 Session 并发导致崩溃 (v1.6.8)
+        # [v2.3.3] 按容器 (即 TDL Session) 分别限流，不同 Session 的下载可以并发
+        self._session_semaphores: Dict[str, Union[asyncio.Lock, asyncio.Semaphore]] = {}
+        self._global_semaphore = asyncio.BoundedSemaphore(TDL_MAX_CONCURRENT)
+        # 进行中的下载: (output_dir, 排序后的 URL, 其余下载参数) -> Task，重复提交的相同下载直接等待已有结果
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        # 每个进行中下载的等待方数量，全部等待方都被取消时才取消下载
+        self._inflight_waiters: Dict[asyncio.Task, int] = {}
+        logger.info(f"[TDL] 下载器初始化: container={self.container_name}, socket={DOCKER_SOCKET}, shards={self._max_parallel_shards}")
     
     async def get_status(self) -> Dict[str, Any]:
         """获取 TDL 状态（异步）"""
-        docker_available, docker_error = await self.docker.is_available()
-        
-        container_running = False
-        container_error = docker_error
-        
-        if docker_available:
-            container_running, container_error = await self.docker.is_container_running(self.container_name)
+        docker_available, docker_error, container_running, container_error = await self.docker.check_status(self.container_name)
         
         status = {
             "docker_available": docker_available,
@@ -444,15 +950,32 @@ class TDLDownloader:
         logger.info(f"[TDL] 状态: docker={docker_available}, container={container_running}, error={container_error}")
         return status
     
+    def _get_session_semaphore(self, session_key: str) -> Union[asyncio.Lock, asyncio.Semaphore]:
+        """获取 Session 对应的并发限制 (按需创建，名额为并行分片数; 单分片时直接用 Lock)"""
+        semaphore = self._session_semaphores.get(session_key)
+        if semaphore is None:
+            if self._max_parallel_shards == 1:
+                semaphore = asyncio.Lock()
+            else:
+                semaphore = asyncio.Semaphore(self._max_parallel_shards)
+            self._session_semaphores[session_key] = semaphore
+        return semaphore
+    
+    async def close(self):
+        """释放 Docker 连接 (应用退出时调用)"""
+        await self.docker.close()
+    
     def generate_telegram_link(self, chat_id: int, message_id: int) -> str:
         """生成 Telegram 消息链接"""
-        if chat_id < 0:
-            clean_id = str(abs(chat_id))
-            if clean_id.startswith("100"):
-                clean_id = clean_id[3:]
-            return f"https://t.me/c/{clean_id}/{message_id}"
-        else:
-            return f"https://t.me/c/{chat_id}/{message_id}"
+        # 整数运算去掉 -100 前缀，不再经过 str -> 切片 -> str
+        cid = -chat_id if chat_id < 0 else chat_id
+        if cid >= _SUPERGROUP_PREFIX:
+            cid -= _SUPERGROUP_PREFIX
+        return f"https://t.me/c/{cid}/{message_id}"
+    
+    def generate_telegram_links(self, chat_ids: List[int], message_ids: List[int]) -> List[str]:
+        """批量生成 Telegram 消息链接 (chat_ids 与 message_ids 一一对应)"""
+        return list(map(self.generate_telegram_link, chat_ids, message_ids))
     
     async def download(
         self,
@@ -462,42 +985,148 @@ class TDLDownloader:
         limit: int = 1,
         file_template: str = None,
         proxy: str = None,
-        stuck_check_callback: callable = None
+        stuck_check_callback: callable = None,
+        on_output: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Dict[str, Any]:
-        """使用 TDL 下载文件 (v2.1.8 稳定版)"""
+        """使用 TDL 下载文件 (v2.1.8 稳定版)
+        
+        on_output: 指定时实时转发 tdl 输出 (v2.3.3)，此时不再写 .tdl.log
+        参数完全相同的下载正在进行时，重复提交会等待并共享同一结果 (v2.3.3)。
+        """
         urls = [url] if isinstance(url, str) else url
-        logger.info(f"[TDL] 下载任务启动: count={len(urls)}, threads={threads}, limit={limit}, dir={output_dir}")
+        if on_output is not None:
+            # 需要独立的输出流，不参与合并
+            return await self._run_download(
+                urls, output_dir, threads, limit, file_template, proxy, stuck_check_callback, on_output
+            )
         
-        # 检查容器状态
-        running, error = await self.docker.is_container_running(self.container_name)
-        if not running:
-            return {"success": False, "error": error or "TDL 容器未运行"}
+        # 线程数、代理、卡死检测等参数不同的下载不能合并
+        key = (output_dir, tuple(sorted(urls)), threads, limit, file_template, proxy, stuck_check_callback)
+        task = self._inflight.get(key)
+        if task is not None:
+            logger.info(f"[TDL] 相同下载已在进行中，等待其结果: count={len(urls)}, dir={output_dir}")
+        else:
+            task = asyncio.ensure_future(self._run_download(
+                urls, output_dir, threads, limit, file_template, proxy, stuck_check_callback, None
+            ))
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._forget_inflight, key))
         
-        # 构建基础命令
-        cmd = ["tdl", "dl"]
-        for u in urls: cmd.extend(["-u", u])
-        cmd.extend(["-d", output_dir, "-t", str(threads), "-l", str(limit), "--skip-same", "--continue"])
+        self._inflight_waiters[task] = self._inflight_waiters.get(task, 0) + 1
+        try:
+            # shield: 任一调用方 (包括发起者) 被取消都不影响其他等待方
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # 最后一个等待方也被取消时，下载结果已无人需要，取消下载本身
+            if self._inflight_waiters[task] == 1:
+                task.cancel()
+                # 立即移除登记，之后的相同提交重新发起下载而不是等到一个已取消的任务
+                self._forget_inflight(key, task)
+            raise
+        finally:
+            remaining = self._inflight_waiters.pop(task) - 1
+            if remaining:
+                self._inflight_waiters[task] = remaining
+    
+    def _forget_inflight(self, key: tuple, task: asyncio.Task):
+        """下载结束后移除登记 (只移除自己，不误删同一参数后续发起的新下载)"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+    
+    async def _run_download(
+        self,
+        urls: List[str],
+        output_dir: str,
+        threads: int,
+        limit: int,
+        file_template: Optional[str],
+        proxy: Optional[str],
+        stuck_check_callback: callable,
+        on_output: Optional[Callable[[str], Awaitable[None]]]
+    ) -> Dict[str, Any]:
+        """执行下载 (按配置拆分分片)"""
+        logger.info(f"[TDL] 下载任务启动: count={len(urls)}, threads={threads}, limit={limit}, dir={output_dir}")
         
-        if file_template:
-            cmd.extend(["--template", file_template])
+        shards = min(self._max_parallel_shards, len(urls))
+        if shards > 1:
+            # 按分片轮流分配 URL，各分片独立执行、独立重试，互不阻塞
+            groups = [urls[i::shards] for i in range(shards)]
+            results = await asyncio.gather(*[
+                self._download_shard(
+                    group, output_dir, threads, min(limit, len(group)), file_template, proxy,
+                    stuck_check_callback, log_name=f".tdl.{index}.log", on_output=on_output
+                )
+                for index, group in enumerate(groups)
+            ])
+            failed = [r for r in results if not r.get("success")]
+            if failed:
+                result = {
+                    "success": False,
+                    "error": f"{len(failed)}/{shards} 个分片失败: {failed[0].get('error')}",
+                    "output": failed[0].get("output", "")
+                }
+            else:
+                result = {"success": True, "output": results[0].get("output", "")}
         else:
-            cmd.extend(["--template", '{{.MessageID}}-{{printf "%d" .DialogID | replace "-" ""}}-{{.FileName}}'])
+            result = await self._download_shard(
+                urls, output_dir, threads, limit, file_template, proxy, stuck_check_callback,
+                on_output=on_output
+            )
         
-        if proxy:
-            cmd.extend(["--proxy", proxy])
+        if result.get("success"):
+            logger.info(f"[TDL] 下载完成: {result.get('output', '')[:200]}")
+        else:
+            logger.error(f"[TDL] 下载失败: {result.get('error')}")
+            # 输出最后 200 个字符的错误信息帮助调试 (错误通常在日志末尾)
+            if result.get("output"):
+                logger.error(f"[TDL] 错误输出: {result.get('output')[-200:]}")
         
-        async with self._semaphore:
+        return result
+    
+    async def _download_shard(
+        self,
+        urls: List[str],
+        output_dir: str,
+        threads: int,
+        limit: int,
+        file_template: Optional[str],
+        proxy: Optional[str],
+        stuck_check_callback: callable = None,
+        log_name: str = TDL_LOG_NAME,
+        on_output: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> Dict[str, Any]:
+        """执行一次 tdl dl (占用一个信号量名额，含重试)"""
+        # 构建基础命令 (一次性生成完整参数列表)
+        cmd = [
+            *_BASE_CMD,
+            *[arg for u in urls for arg in ("-u", u)],
+            "-d", output_dir, "-t", str(threads), "-l", str(limit), *_RESUME_ARGS,
+            *(("--template", file_template) if file_template else _DEFAULT_TEMPLATE_ARGS),
+            *(("--proxy", proxy) if proxy else ()),
+        ]
+        
+        if self._max_parallel_shards == 1:
+            # 清理残留 tdl 进程与下载合并为一次 exec，省去单独清理的 create/start/inspect 往返
+            # (并行分片时不能清理，否则会杀掉其他分片的 tdl)
+            shell_cmd = ["sh", "-c", "killall -9 tdl || pkill -9 tdl || true; exec " + " ".join(map(shlex.quote, cmd))]
+        else:
+            shell_cmd = cmd
+        
+        # 先占 Session 名额再占全局名额，排队等 Session 时不占用全局名额
+        async with self._get_session_semaphore(self.container_name), self._global_semaphore:
             max_retries = 2
             result = {"success": False, "error": "Unknown error"}
             for attempt in range(max_retries):
-                # 清理
-                await self.docker.exec_command(self.container_name, ["sh", "-c", "killall -9 tdl || pkill -9 tdl || true"], timeout=10.0)
                 # 执行 (1 小时超时)
                 result = await self.docker.exec_command(
                     self.container_name, 
-                    cmd, 
+                    shell_cmd, 
                     timeout=3600.0,
-                    stuck_check_callback=stuck_check_callback
+                    stuck_check_callback=stuck_check_callback,
+                    # 输出先写到下载目录下的临时日志，执行结束后由容器内脚本删除
+                    # 需要实时转发输出时不重定向，输出经 attach 流返回
+                    log_path=None if on_output else os.path.join(output_dir, log_name),
+                    on_output=on_output
                 )
                 
                 if result.get("success"): break
@@ -505,14 +1134,6 @@ class TDLDownloader:
                     await asyncio.sleep(2.0)
                     continue
                 break
-        if result.get("success"):
-            logger.info(f"[TDL] 下载完成: {result.get('output', '')[:200]}")
-        else:
-            logger.error(f"[TDL] 下载失败: {result.get('error')}")
-            # 输出前 200 个字符的错误信息帮助调试
-            if result.get("output"):
-                logger.error(f"[TDL] 错误输出: {result.get('output')[:200]}")
-        
         return result
     
     async def download_by_message(
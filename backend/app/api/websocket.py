@@ -4,19 +4,54 @@ TG Export - WebSocket 实时通信
 """
 import asyncio
 import json
-from typing import Dict, Set
+import logging
+from collections import defaultdict
+from typing import DefaultDict, Dict, Optional, Set, Union
 from fastapi import WebSocket, WebSocketDisconnect
 
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时退回标准库
+    orjson = None
+
 from ..models import ExportTask
 from ..telegram import export_manager
 
+logger = logging.getLogger(__name__)
+
+# 进度推送的合并间隔 (秒): 期间同一任务的多次更新只推送最新状态
+PROGRESS_FLUSH_INTERVAL = 0.1
+# 每个合并周期内单个任务最多推送的 TDL 输出字符数 (超出时只保留末尾)
+OUTPUT_FLUSH_LIMIT = 4096
+
+
+def _dumps_text(message: dict) -> str:
+    """序列化为紧凑 JSON 文本 (格式与 send_json 一致)"""
+    if orjson is not None:
+        return orjson.dumps(message).decode()
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def _loads(data: Union[str, bytes]):
+    """解析客户端消息 (文本帧或二进制帧均可)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 
 class ConnectionManager:
     """WebSocket 连接管理器"""
     
     def __init__(self):
         self.active_connections: Set[WebSocket] = set()
-        self.task_subscribers: Dict[str, Set[WebSocket]] = {}
+        self.task_subscribers: DefaultDict[str, Set[WebSocket]] = defaultdict(set)
+        # 待推送的任务进度 (task_id -> 最新的 task)，由后台任务定时合并发送
+        self._pending: Dict[str, ExportTask] = {}
+        # 待推送的 TDL 输出 (task_id -> 合并后的文本)，与进度一起定时发送
+        self._pending_output: Dict[str, str] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        # 已注册进度回调的任务，避免重复订阅时重复注册
+        self._callback_tasks: Set[str] = set()
     
     async def connect(self, websocket: WebSocket):
         """接受连接"""
@@ -32,19 +67,59 @@ class ConnectionManager:
     
     def subscribe_task(self, websocket: WebSocket, task_id: str):
         """订阅任务进度"""
-        if task_id not in self.task_subscribers:
-            self.task_subscribers[task_id] = set()
         self.task_subscribers[task_id].add(websocket)
     
     def unsubscribe_task(self, websocket: WebSocket, task_id: str):
         """取消订阅"""
-        if task_id in self.task_subscribers:
-            self.task_subscribers[task_id].discard(websocket)
+        subscribers = self.task_subscribers.get(task_id)
+        if subscribers:
+            subscribers.discard(websocket)
+    
+    def has_subscribers(self, task_id: str) -> bool:
+        """任务当前是否有订阅者"""
+        return bool(self.task_subscribers.get(task_id))
+    
+    def schedule_task_progress(self, task: ExportTask):
+        """记录任务最新进度，由后台任务每 PROGRESS_FLUSH_INTERVAL 秒合并推送一次 (v2.3.3)"""
+        if not self.task_subscribers.get(task.id):
+            return
+        self._pending[task.id] = task
+        self._ensure_flush_task()
+    
+    def schedule_task_output(self, task_id: str, text: str):
+        """记录 TDL 实时输出，与进度一起合并推送 (每周期最多 OUTPUT_FLUSH_LIMIT 个字符)"""
+        if not self.task_subscribers.get(task_id):
+            return
+        self._pending_output[task_id] = (self._pending_output.get(task_id, "") + text)[-OUTPUT_FLUSH_LIMIT:]
+        self._ensure_flush_task()
+    
+    def _ensure_flush_task(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def _flush_loop(self):
+        """定时推送合并后的进度与输出，没有待推送内容时自动退出"""
+        while self._pending or self._pending_output:
+            await asyncio.sleep(PROGRESS_FLUSH_INTERVAL)
+            pending, self._pending = self._pending, {}
+            # 断开的连接已在 _broadcast 中处理，到这里的异常是序列化等真实错误:
+            # 记录后继续推送其他任务，不让一个任务的错误中断整个推送循环
+            for task in pending.values():
+                try:
+                    await self.broadcast_task_progress(task)
+                except Exception:
+                    logger.exception(f"[WebSocket] 推送任务进度失败: {task.id}")
+            pending_output, self._pending_output = self._pending_output, {}
+            for task_id, text in pending_output.items():
+                try:
+                    await self._broadcast(task_id, {"type": "task_output", "task_id": task_id, "data": text})
+                except Exception:
+                    logger.exception(f"[WebSocket] 推送任务输出失败: {task_id}")
     
     async def broadcast_task_progress(self, task: ExportTask):
         """广播任务进度"""
         task_id = task.id
-        if task_id not in self.task_subscribers:
+        if not self.task_subscribers.get(task_id):
             return
         
         message = {
@@ -62,22 +137,34 @@ class ConnectionManager:
                 "error": task.error
             }
         }
+        await self._broadcast(task_id, message)
+    
+    async def _broadcast(self, task_id: str, message: dict):
+        """把消息发送给任务的所有订阅者"""
+        subscribers = self.task_subscribers.get(task_id)
+        if not subscribers:
+            return
+        # 取快照: 发送过程中 disconnect() 可能修改订阅集合
+        targets = tuple(subscribers)
         
-        dead_connections = set()
-        for websocket in self.task_subscribers[task_id]:
-            try:
-                await websocket.send_json(message)
-            except Exception:
-                dead_connections.add(websocket)
+        # 只序列化一次，所有订阅者共用同一份文本
+        payload = _dumps_text(message)
+        
+        # 并发发送，慢客户端不会拖住其他订阅者
+        results = await asyncio.gather(
+            *[websocket.send_text(payload) for websocket in targets],
+            return_exceptions=True
+        )
         
         # 清理断开的连接
-        for ws in dead_connections:
-            self.disconnect(ws)
+        for ws, result in zip(targets, results):
+            if isinstance(result, Exception):
+                self.disconnect(ws)
     
     async def send_notification(self, websocket: WebSocket, message: dict):
         """发送通知"""
         try:
-            await websocket.send_json(message)
+            await websocket.send_text(_dumps_text(message))
         except Exception:
             self.disconnect(websocket)
 
@@ -92,7 +179,20 @@ async def websocket_endpoint(websocket: WebSocket):
     
     try:
         while True:
-            data = await websocket.receive_json()
+            # 直接取原始帧解析，省去 receive_json 的解码与标准库 json 解析
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            
+            raw = message.get("text")
+            if raw is None:
+                raw = message.get("bytes")
+            try:
+                data = _loads(raw)
+            except (ValueError, TypeError):
+                continue  # 忽略无法解析的消息，不断开连接
+            if not isinstance(data, dict):
+                continue
             
             action = data.get("action")
             
@@ -100,15 +200,14 @@ async def websocket_endpoint(websocket: WebSocket):
                 task_id = data.get("task_id")
                 if task_id:
                     manager.subscribe_task(websocket, task_id)
-                    # 注册进度回调
-                    export_manager.add_progress_callback(
-                        task_id,
-                        lambda t: manager.broadcast_task_progress(t)
-                    )
-                    await websocket.send_json({
+                    # 注册进度回调 (每个任务只注册一次，高频更新合并后再推送)
+                    if task_id not in manager._callback_tasks:
+                        manager._callback_tasks.add(task_id)
+                        export_manager.add_progress_callback(task_id, manager.schedule_task_progress)
+                    await websocket.send_text(_dumps_text({
                         "type": "subscribed",
                         "task_id": task_id
-                    })
+                    }))
             
             elif action == "unsubscribe":
                 task_id = data.get("task_id")
@@ -116,7 +215,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     manager.unsubscribe_task(websocket, task_id)
             
             elif action == "ping":
-                await websocket.send_json({"type": "pong"})
+                await websocket.send_text(_dumps_text({"type": "pong"}))
     
     except WebSocketDisconnect:
         manager.disconnect(websocket)
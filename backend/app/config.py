@@ -2,6 +2,7 @@
 TG Export - 配置管理
 """
 import os
+from functools import lru_cache
 from pathlib import Path
 from pydantic_settings import BaseSettings
 
@@ -40,7 +41,7 @@ class Settings(BaseSettings):
     
     # 导出设置
     MAX_CONCURRENT_DOWNLOADS: int = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", 5))
-    CHUNK_SIZE: int = 1024 * 1024  # 1MB
+    CHUNK_SIZE: int = 1024 * 1024  # 1MB (upload.getFile 单次请求上限，不能再调大)
     
     # 并行分块下载设置 (单文件多连接)
     PARALLEL_CHUNK_CONNECTIONS: int = int(os.getenv("PARALLEL_CHUNK_CONNECTIONS", 4))
@@ -53,4 +54,11 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
 
-settings = Settings()
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """获取配置单例 (每个进程只构建并校验一次，可用于 Depends(get_settings))"""
+    return Settings()
+
+
+settings = get_settings()
@@ -1,7 +1,24 @@
 """
 TG Export - Exporters Package
 """
-from . import json_export as json_exporter
-from . import html_export as html_exporter
+import importlib
 
 __all__ = ["json_exporter", "html_exporter"]
+
+# 导出器按需加载: 只有真正执行导出时才导入对应模块
+_LAZY_MODULES = {
+    "json_exporter": ".json_export",
+    "html_exporter": ".html_export",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_MODULES:
+        module = importlib.import_module(_LAZY_MODULES[name], __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -2,14 +2,73 @@
 TG Export - HTML 导出器
 生成与 Telegram Desktop 官方导出完全兼容的 HTML 格式
 """
+import asyncio
+from collections import defaultdict
 from pathlib import Path
-from typing import List, Dict
+from typing import Dict, List, Iterator
 from datetime import datetime
 import html
+import logging
+import os
 import shutil
 
 from ..models import ExportTask, ChatInfo, MessageInfo, MediaType
-from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# 写出 HTML 页面时的文件缓冲区大小: 逐条写入消息片段，由大缓冲区合并成少量 write 系统调用
+WRITE_BUFFER_SIZE = 256 * 1024
+
+# 头像颜色类与媒体 CSS 类在导入时构建一次，避免每条消息重建
+_USERPIC_CLASSES = ('userpic1', 'userpic2', 'userpic3', 'userpic4', 'userpic5', 'userpic6', 'userpic7', 'userpic8')
+
+_MEDIA_TYPE_CLASSES = {
+    MediaType.PHOTO: 'media_photo',
+    MediaType.VIDEO: 'media_video',
+    MediaType.AUDIO: 'media_audio_file',
+    MediaType.VOICE: 'media_voice_message',
+    MediaType.VIDEO_NOTE: 'media_video',
+    MediaType.DOCUMENT: 'media_file',
+    MediaType.STICKER: 'media_photo',
+    MediaType.ANIMATION: 'media_video',
+}
+
+# 文件大小单位，下标为 1024 的幂次
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB')
+
+
+def _sync_static_tree(src: Path, dst: Path) -> None:
+    """复制静态资源目录，跳过目标中已是最新的文件
+
+    实际复制仍交给 shutil.copy2 (Linux 上走 sendfile 零拷贝)；
+    重复导出到同一目录时，大小一致且不旧于源文件的资源直接跳过。
+    """
+    dst.mkdir(parents=True, exist_ok=True)
+    with os.scandir(src) as it:
+        for entry in it:
+            target = dst / entry.name
+            if entry.is_dir():
+                _sync_static_tree(Path(entry.path), target)
+                continue
+            st = entry.stat()
+            try:
+                dst_st = target.stat()
+                if dst_st.st_size == st.st_size and dst_st.st_mtime >= st.st_mtime:
+                    continue
+            except OSError:
+                pass
+            shutil.copy2(entry.path, target)
+
+
+def _copy_static_assets(export_path: Path) -> None:
+    """复制 css/js/images 静态资源到导出目录 (纯同步，在线程中调用)"""
+    templates_dir = Path(__file__).parent / "templates"
+    if not templates_dir.exists():
+        return
+    for folder in ['css', 'js', 'images']:
+        src = templates_dir / folder
+        if src.exists():
+            _sync_static_tree(src, export_path / folder)
 
 
 def _escape_html(text: str) -> str:
@@ -19,13 +78,6 @@ def _escape_html(text: str) -> str:
     return html.escape(text).replace('\n', '<br>')
 
 
-def _format_date(dt: datetime) -> str:
-    """格式化日期时间"""
-    if not dt:
-        return ""
-    return dt.strftime("%H:%M")
-
-
 def _format_date_title(dt: datetime) -> str:
     """格式化日期时间标题"""
     if not dt:
@@ -46,18 +98,14 @@ def _format_size(size: int) -> str:
         return ""
     if size < 1024:
         return f"{size} B"
-    elif size < 1024 * 1024:
-        return f"{size / 1024:.1f} KB"
-    elif size < 1024 * 1024 * 1024:
-        return f"{size / 1024 / 1024:.1f} MB"
-    else:
-        return f"{size / 1024 / 1024 / 1024:.1f} GB"
+    # 由位长直接得出单位 (每 10 位一级)，GB 封顶
+    unit = min((size.bit_length() - 1) // 10, 3)
+    return f"{size / (1 << (unit * 10)):.1f} {_SIZE_UNITS[unit]}"
 
 
 def _get_userpic_class(user_id: int) -> str:
     """获取用户头像颜色类"""
-    colors = ['userpic1', 'userpic2', 'userpic3', 'userpic4', 'userpic5', 'userpic6', 'userpic7', 'userpic8']
-    return colors[abs(user_id or 0) % len(colors)]
+    return _USERPIC_CLASSES[abs(user_id or 0) % len(_USERPIC_CLASSES)]
 
 
 def _get_initials(name: str) -> str:
@@ -69,91 +117,104 @@ def _get_initials(name: str) -> str:
 
 def _get_media_type_class(media_type: MediaType) -> str:
     """获取媒体类型的 CSS 类"""
-    mapping = {
-        MediaType.PHOTO: 'media_photo',
-        MediaType.VIDEO: 'media_video',
-        MediaType.AUDIO: 'media_audio_file',
-        MediaType.VOICE: 'media_voice_message',
-        MediaType.VIDEO_NOTE: 'media_video',
-        MediaType.DOCUMENT: 'media_file',
-        MediaType.STICKER: 'media_photo',
-        MediaType.ANIMATION: 'media_video',
-    }
-    return mapping.get(media_type, 'media_file')
+    return _MEDIA_TYPE_CLASSES.get(media_type, 'media_file')
 
 
-def _generate_message_html(msg: MessageInfo, is_joined: bool = False) -> str:
-    """生成单条消息的 HTML - 官方格式"""
-    joined_class = 'joined' if is_joined else ''
-    
-    # 用户头像
-    userpic_html = ''
-    from_name_html = ''
-    if not is_joined:
-        userpic_class = _get_userpic_class(msg.from_user_id)
-        initials = _get_initials(msg.from_user_name)
-        userpic_html = f'''
-      <div class="pull_left userpic_wrap">
-       <div class="userpic {userpic_class}" style="width: 42px; height: 42px">
-        <div class="initials" style="line-height: 42px">{initials}</div>
-       </div>
-      </div>'''
-        from_name_html = f'''
-       <div class="from_name">
-{_escape_html(msg.from_user_name or "未知")} 
-       </div>'''
-    
-    # 媒体内容
-    media_html = ''
-    if msg.media_type and msg.file_name:
-        media_class = _get_media_type_class(msg.media_type)
-        file_size = _format_size(msg.file_size) if msg.file_size else ''
-        
-        if msg.media_path:
-            # 已下载
-            if msg.media_type == MediaType.PHOTO:
-                media_html = f'''
+def _render_photo_media(msg: MessageInfo) -> str:
+    """已下载的图片"""
+    return f'''
        <div class="media_wrap clearfix">
         <a class="photo_wrap clearfix pull_left" href="{msg.media_path}">
          <img class="photo" src="{msg.media_path}" style="max-width: 300px;">
         </a>
        </div>'''
-            elif msg.media_type == MediaType.VIDEO:
-                media_html = f'''
+
+
+def _render_video_media(msg: MessageInfo) -> str:
+    """已下载的视频"""
+    return f'''
        <div class="media_wrap clearfix">
         <div class="video_file_wrap clearfix pull_left">
          <video class="video_file" src="{msg.media_path}" controls style="max-width: 400px;"></video>
         </div>
        </div>'''
-            elif msg.media_type in [MediaType.VOICE, MediaType.AUDIO]:
-                media_html = f'''
+
+
+def _render_audio_media(msg: MessageInfo) -> str:
+    """已下载的语音/音频"""
+    return f'''
        <div class="media_wrap clearfix">
         <audio src="{msg.media_path}" controls></audio>
        </div>'''
-            else:
-                media_html = f'''
+
+
+def _render_file_media(msg: MessageInfo) -> str:
+    """已下载的其它文件"""
+    return f'''
        <div class="media_wrap clearfix">
-        <div class="media clearfix pull_left {media_class}">
+        <div class="media clearfix pull_left {_get_media_type_class(msg.media_type)}">
          <div class="fill pull_left"></div>
          <div class="body">
           <div class="title bold"><a href="{msg.media_path}">{_escape_html(msg.file_name)}</a></div>
-          <div class="status details">{file_size}</div>
+          <div class="status details">{_format_size(msg.file_size)}</div>
          </div>
         </div>
        </div>'''
-        else:
-            # 未下载
-            media_html = f'''
+
+
+def _render_missing_media(msg: MessageInfo) -> str:
+    """未下载的媒体"""
+    return f'''
        <div class="media_wrap clearfix">
-        <div class="media clearfix pull_left {media_class}">
+        <div class="media clearfix pull_left {_get_media_type_class(msg.media_type)}">
          <div class="fill pull_left"></div>
          <div class="body">
           <div class="title bold">{_escape_html(msg.file_name)}</div>
           <div class="description">Not downloaded</div>
-          <div class="status details">{file_size}</div>
+          <div class="status details">{_format_size(msg.file_size)}</div>
          </div>
         </div>
        </div>'''
+
+
+# 已下载媒体的渲染分派表，未列出的类型使用 _render_file_media
+_MEDIA_RENDERERS = {
+    MediaType.PHOTO: _render_photo_media,
+    MediaType.VIDEO: _render_video_media,
+    MediaType.VOICE: _render_audio_media,
+    MediaType.AUDIO: _render_audio_media,
+}
+
+
+def _generate_message_html(msg: MessageInfo, is_joined: bool = False) -> str:
+    """生成单条消息的 HTML - 官方格式"""
+    joined_class = 'joined' if is_joined else ''
+    
+    # 用户头像
+    userpic_html = ''
+    from_name_html = ''
+    if not is_joined:
+        userpic_class = _get_userpic_class(msg.from_user_id)
+        initials = _get_initials(msg.from_user_name)
+        userpic_html = f'''
+      <div class="pull_left userpic_wrap">
+       <div class="userpic {userpic_class}" style="width: 42px; height: 42px">
+        <div class="initials" style="line-height: 42px">{initials}</div>
+       </div>
+      </div>'''
+        from_name_html = f'''
+       <div class="from_name">
+{_escape_html(msg.from_user_name or "未知")} 
+       </div>'''
+    
+    # 媒体内容: 已下载的按类型查表分派，其余统一为文件卡片
+    media_html = ''
+    if msg.media_type and msg.file_name:
+        if msg.media_path:
+            render = _MEDIA_RENDERERS.get(msg.media_type, _render_file_media)
+        else:
+            render = _render_missing_media
+        media_html = render(msg)
     
     # 文本内容
     text_html = ''
@@ -161,11 +222,14 @@ def _generate_message_html(msg: MessageInfo, is_joined: bool = False) -> str:
         text_html = f'''
        <div class="text">{_escape_html(msg.text)}</div>'''
     
+    # 完整时间标题只 strftime 一次，显示用的 HH:MM 直接从中截取
+    date_title = _format_date_title(msg.date)
+    
     return f'''
      <div class="message default clearfix {joined_class}" id="message{msg.id}">
 {userpic_html}
       <div class="body">
-       <div class="pull_right date details" title="{_format_date_title(msg.date)}">{_format_date(msg.date)}</div>
+       <div class="pull_right date details" title="{date_title}">{date_title[11:16]}</div>
 {from_name_html}
 {media_html}
 {text_html}
@@ -174,6 +238,71 @@ def _generate_message_html(msg: MessageInfo, is_joined: bool = False) -> str:
 '''
 
 
+def _iter_history_html(messages: List[MessageInfo]) -> Iterator[str]:
+    """逐条生成消息列表的 HTML 片段 (含日期分隔)"""
+    last_date = None
+    last_user = None
+    
+    for msg in messages:
+        # 添加日期分隔
+        if msg.date:
+            msg_date = msg.date.date()
+            if msg_date != last_date:
+                yield f'''
+     <div class="message service" id="message-date-{msg.id}">
+      <div class="body details">{_format_date_header(msg.date)}</div>
+     </div>'''
+                last_date = msg_date
+                last_user = None
+        
+        # 判断是否连续消息
+        is_joined = (msg.from_user_id == last_user)
+        yield _generate_message_html(msg, is_joined)
+        last_user = msg.from_user_id
+
+
+def _write_chat_page(chat: ChatInfo, chat_messages: List[MessageInfo], chat_folder: Path) -> None:
+    """生成单个对话的 messages.html (纯同步，在线程中调用)"""
+    chat_folder.mkdir(parents=True, exist_ok=True)
+    
+    # 页面头尾固定，中间的消息片段逐条写入文件，不在内存中拼出整页
+    page_head = f'''<!DOCTYPE html>
+<html>
+ <head>
+  <meta charset="utf-8"/>
+  <title>{_escape_html(chat.title)}</title>
+  <meta content="width=device-width, initial-scale=1.0" name="viewport"/>
+  <link href="../../css/style.css" rel="stylesheet"/>
+  <script src="../../js/script.js" type="text/javascript"></script>
+ </head>
+ <body onload="CheckLocation();">
+  <div class="page_wrap">
+   <div class="page_header">
+    <a class="content block_link" href="../../lists/chats.html" onclick="return GoBack(this)">
+     <div class="text bold">{_escape_html(chat.title)}</div>
+    </a>
+   </div>
+   <div class="page_body chat_page">
+    <div class="history">
+'''
+    page_tail = '''
+    </div>
+   </div>
+  </div>
+ </body>
+</html>'''
+    
+    with open(chat_folder / "messages.html", "w", encoding="utf-8", buffering=WRITE_BUFFER_SIZE) as f:
+        f.write(page_head)
+        for fragment in _iter_history_html(chat_messages):
+            f.write(fragment)
+        f.write(page_tail)
+    try:
+        os.chmod(chat_folder, 0o777)
+        os.chmod(chat_folder / "messages.html", 0o777)
+    except: pass
+
+
 async def export(
     task: ExportTask,
     chats: List[ChatInfo],
@@ -184,17 +313,29 @@ async def export(
     导出为 HTML 格式
     完全兼容 Telegram Desktop 官方导出
     """
-    # 获取模板目录
-    templates_dir = Path(__file__).parent / "templates"
-    
-    # 复制静态资源
-    if templates_dir.exists():
-        for folder in ['css', 'js', 'images']:
-            src = templates_dir / folder
-            dst = export_path / folder
-            if src.exists():
-                shutil.copytree(src, dst, dirs_exist_ok=True)
-    
+    # 静态资源在后台线程复制，与页面生成重叠进行，返回前再等待完成
+    copy_task = asyncio.create_task(asyncio.to_thread(_copy_static_assets, export_path))
+    try:
+        result = await _write_pages(task, chats, messages, export_path)
+    except BaseException:
+        # 页面生成出错时同样等复制结束，避免导出已失败后线程还在写导出目录;
+        # 复制本身的错误只记录日志，不掩盖原始异常
+        try:
+            await copy_task
+        except Exception:
+            logger.exception(f"[HTML] 静态资源复制失败: {export_path}")
+        raise
+    await copy_task
+    return result
+
+
+async def _write_pages(
+    task: ExportTask,
+    chats: List[ChatInfo],
+    messages: List[MessageInfo],
+    export_path: Path
+) -> str:
+    """生成 lists / chats 下的所有页面与入口页面，返回入口页面路径"""
     # 创建 lists 目录
     lists_dir = export_path / "lists"
     lists_dir.mkdir(parents=True, exist_ok=True)
@@ -205,7 +346,6 @@ async def export(
     
     # 设置目录权限
     try:
-        import os
         for d in [lists_dir, chats_dir]:
             os.chmod(d, 0o777)
     except: pass
@@ -258,74 +398,27 @@ async def export(
         os.chmod(lists_dir / "chats.html", 0o777)
     except: pass
     
-    # 为每个聊天生成消息页面
-    # 按聊天ID分组消息
-    messages_by_chat: Dict[int, List[MessageInfo]] = {}
+    # 单次遍历按对话分组消息，每个对话页面只取自己的消息
+    # 没有 chat_id 的消息无法归属，按原行为写入每个对话页面
+    chat_ids = [chat.id for chat in chats]
+    messages_by_chat: Dict[int, List[MessageInfo]] = defaultdict(list)
     for msg in messages:
-        chat_id = msg.from_user_id or 0  # 临时使用
-        # 实际应该从消息中获取 chat_id
-        messages_by_chat.setdefault(0, []).append(msg)
+        if msg.chat_id is None:
+            for chat_id in chat_ids:
+                messages_by_chat[chat_id].append(msg)
+        else:
+            messages_by_chat[msg.chat_id].append(msg)
     
+    # 为每个聊天生成消息页面
     for chat in chats:
+        chat_messages = messages_by_chat.get(chat.id, ())
         chat_folder = chats_dir / f"chat_{abs(chat.id)}"
-        chat_folder.mkdir(parents=True, exist_ok=True)
-        
-        # 获取该聊天的消息
-        chat_messages = [m for m in messages if True]  # 暂时使用所有消息
-        
-        # 生成消息 HTML
-        messages_html_parts = []
-        last_date = None
-        last_user = None
-        
-        for msg in chat_messages:
-            # 添加日期分隔
-            if msg.date:
-                msg_date = msg.date.date()
-                if msg_date != last_date:
-                    messages_html_parts.append(f'''
-     <div class="message service" id="message-date-{msg.id}">
-      <div class="body details">{_format_date_header(msg.date)}</div>
-     </div>''')
-                    last_date = msg_date
-                    last_user = None
-            
-            # 判断是否连续消息
-            is_joined = (msg.from_user_id == last_user)
-            messages_html_parts.append(_generate_message_html(msg, is_joined))
-            last_user = msg.from_user_id
-        
-        messages_page_html = f'''<!DOCTYPE html>
-<html>
- <head>
-  <meta charset="utf-8"/>
-  <title>{_escape_html(chat.title)}</title>
-  <meta content="width=device-width, initial-scale=1.0" name="viewport"/>
-  <link href="../../css/style.css" rel="stylesheet"/>
-  <script src="../../js/script.js" type="text/javascript"></script>
- </head>
- <body onload="CheckLocation();">
-  <div class="page_wrap">
-   <div class="page_header">
-    <a class="content block_link" href="../../lists/chats.html" onclick="return GoBack(this)">
-     <div class="text bold">{_escape_html(chat.title)}</div>
-    </a>
-   </div>
-   <div class="page_body chat_page">
-    <div class="history">
-{''.join(messages_html_parts)}
-    </div>
-   </div>
-  </div>
- </body>
-</html>'''
-        
-        with open(chat_folder / "messages.html", "w", encoding="utf-8") as f:
-            f.write(messages_page_html)
-        try:
-            os.chmod(chat_folder, 0o777)
-            os.chmod(chat_folder / "messages.html", 0o777)
-        except: pass
+        # 本次没有新消息的对话: 已有页面直接保留，不重写成空页；
+        # 从未生成过的仍写一个空页，保证聊天列表中的链接有效
+        if not chat_messages and (chat_folder / "messages.html").exists():
+            continue
+        # 页面渲染与写盘是同步的 CPU/IO 工作，放到线程中执行，避免阻塞事件循环
+        await asyncio.to_thread(_write_chat_page, chat, chat_messages, chat_folder)
     
     # 生成入口页面
     export_results_html = f'''<!DOCTYPE html>
@@ -367,11 +460,3 @@ async def export(
     except: pass
     
     return str(export_path / "export_results.html")
-
-
-def _safe_filename(name: str) -> str:
-    """生成安全的文件名"""
-    invalid_chars = '<>:"/\\|?*'
-    for char in invalid_chars:
-        name = name.replace(char, '_')
-    return name[:50]
@@ -3,19 +3,53 @@ TG Export - JSON 导出器
 生成机器可读的 JSON 格式
 """
 import json
+import os
 from pathlib import Path
 from typing import List
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时退回标准库
+    orjson = None
+
 from ..models import ExportTask, ChatInfo, MessageInfo
 
+# 写出 export.json 时的文件缓冲区大小: 消息逐条序列化写入，由大缓冲区合并系统调用
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+def _json_default(obj):
+    """标准库回退路径的 default 回调: 日期时间转 ISO 字符串"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _dumps_indented(data) -> bytes:
+    """序列化为 2 空格缩进的 UTF-8 JSON (orjson 原生支持 datetime)"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    return json.dumps(data, ensure_ascii=False, indent=2, default=_json_default).encode("utf-8")
 
-class DateTimeEncoder(json.JSONEncoder):
-    """日期时间 JSON 编码器"""
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super().default(obj)
+
+def _message_dict(msg: MessageInfo) -> dict:
+    """单条消息的导出结构"""
+    return {
+        "id": msg.id,
+        "chat_id": msg.chat_id,
+        "date": msg.date.isoformat() if msg.date else None,
+        "from_user_id": msg.from_user_id,
+        "from_user_name": msg.from_user_name,
+        "text": msg.text,
+        "media": {
+            "type": msg.media_type.value if msg.media_type else None,
+            "file": msg.media_path,
+            "file_name": msg.file_name,
+            "file_size": msg.file_size
+        } if msg.media_type else None,
+        "reply_to": msg.reply_to_message_id
+    }
 
 
 async def export(
@@ -31,15 +65,9 @@ async def export(
     {
         "export_info": {...},
         "chats": [...],
-        "messages": {...}
+        "messages": [...]   # 每条消息带 chat_id
     }
     """
-    # 按聊天分组消息
-    messages_by_chat = {}
-    for msg in messages:
-        # 这里需要chat_id信息，暂时用文件路径分组
-        pass
-    
     # 构建导出数据
     export_data = {
         "export_info": {
@@ -64,34 +92,26 @@ async def export(
                 "members_count": chat.members_count
             }
             for chat in chats
-        ],
-        "messages": [
-            {
-                "id": msg.id,
-                "date": msg.date.isoformat() if msg.date else None,
-                "from_user_id": msg.from_user_id,
-                "from_user_name": msg.from_user_name,
-                "text": msg.text,
-                "media": {
-                    "type": msg.media_type.value if msg.media_type else None,
-                    "file": msg.media_path,
-                    "file_name": msg.file_name,
-                    "file_size": msg.file_size
-                } if msg.media_type else None,
-                "reply_to": msg.reply_to_message_id
-            }
-            for msg in messages
         ]
     }
     
-    # 写入文件
+    # 写入文件: messages 数组逐条序列化写出，不在内存中构建完整列表
+    # 输出与整体 indent=2 序列化逐字节一致 (每条消息缩进 4 格)
     output_file = export_path / "export.json"
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(export_data, f, ensure_ascii=False, indent=2, cls=DateTimeEncoder)
+    head = _dumps_indented(export_data)
+    with open(output_file, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+        # 去掉末尾的 "\n}"，接上 messages 字段
+        f.write(head[:-2])
+        f.write(b',\n  "messages": [')
+        first = True
+        for msg in messages:
+            f.write(b"\n    " if first else b",\n    ")
+            f.write(_dumps_indented(_message_dict(msg)).replace(b"\n", b"\n    "))
+            first = False
+        f.write(b"]\n}" if first else b"\n  ]\n}")
     
     # 强制设置 777 权限
     try:
-        import os
         os.chmod(output_file, 0o777)
     except: pass
     
@@ -1,17 +1,22 @@
 """
 TG Export - FastAPI 主入口
 """
-from fastapi import FastAPI
+import asyncio
+import atexit
+import hashlib
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from pathlib import Path
 
 from .config import settings
 from .api import router, init_admin_user, websocket_endpoint
 import logging
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener, RotatingFileHandler
 
 
 # 配置日志
@@ -24,21 +29,44 @@ log_level = logging.INFO
 if hasattr(settings, "LOG_LEVEL"):
     log_level = getattr(logging, settings.LOG_LEVEL.upper(), logging.INFO)
 
+# 文件日志攒批写入: 满 256 条、出现 ERROR 或定时刷新时才落盘
+LOG_BUFFER_CAPACITY = 256
+LOG_FLUSH_INTERVAL = 1.0
+
+# 文件输出（自动轮转，最大10MB，保留5个备份）
+log_file_buffer = MemoryHandler(
+    capacity=LOG_BUFFER_CAPACITY,
+    flushLevel=logging.ERROR,
+    target=RotatingFileHandler(
+        log_file,
+        maxBytes=10*1024*1024,  # 10MB
+        backupCount=5,
+        encoding='utf-8'
+    ),
+    flushOnClose=True
+)
+
+# 日志经队列交给后台线程输出: 事件循环里只做一次入队，
+# 控制台/文件写入与轮转检查都在 QueueListener 线程中完成
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(
+    log_queue,
+    # 控制台输出
+    logging.StreamHandler(sys.stdout),
+    # 文件输出 (经缓冲)
+    log_file_buffer,
+    respect_handler_level=True
+)
+
+# 格式化在 QueueHandler 入队前完成，下游 handler 直接输出已格式化的消息
 logging.basicConfig(
     level=log_level,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        # 控制台输出
-        logging.StreamHandler(sys.stdout),
-        # 文件输出（自动轮转，最大10MB，保留5个备份）
-        RotatingFileHandler(
-            log_file,
-            maxBytes=10*1024*1024,  # 10MB
-            backupCount=5,
-            encoding='utf-8'
-        )
-    ]
+    handlers=[QueueHandler(log_queue)]
 )
+log_listener.start()
+# 进程退出时停止日志线程并写出队列中剩余的日志 (晚于 uvicorn 自身的关闭日志)
+atexit.register(log_listener.stop)
 
 # 禁止 pyrogram 的 DEBUG 日志 (太吵了)
 logging.getLogger("pyrogram").setLevel(logging.INFO)
@@ -46,13 +74,33 @@ logging.getLogger("pyrogram").setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 logger.info(f"日志已配置，存储路径: {log_file}")
 
+async def flush_log_buffer_loop():
+    """定时写出缓冲中的文件日志 (在线程中刷新，不阻塞事件循环)"""
+    while True:
+        await asyncio.sleep(LOG_FLUSH_INTERVAL)
+        await asyncio.to_thread(log_file_buffer.flush)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期 (替代已弃用的 on_event 启动/关闭钩子)"""
+    log_flush_task = asyncio.create_task(flush_log_buffer_loop())
+    await startup_event()
+    try:
+        yield
+    finally:
+        await shutdown_event()
+        log_flush_task.cancel()
+
+
 # 创建 FastAPI 应用
 app = FastAPI(
     title="TG Export",
     description="Telegram 全功能导出工具",
     version="2.3.2",
     docs_url="/api/docs",
-    redoc_url="/api/redoc"
+    redoc_url="/api/redoc",
+    lifespan=lifespan
 )
 
 # CORS 配置
@@ -70,6 +118,16 @@ app.include_router(router, prefix="/api")
 # WebSocket 路由
 app.websocket("/ws")(websocket_endpoint)
 
+class CachedStaticFiles(StaticFiles):
+    """带长期缓存头的静态文件 (Vite 构建产物文件名含内容哈希，内容变化即换名)"""
+    
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code == 200:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
 # 静态文件 - 前端
 # Docker 中路径为 /app/frontend/dist，开发环境为相对路径
 frontend_path = Path(__file__).parent.parent / "frontend" / "dist"
@@ -81,30 +139,47 @@ if not frontend_path.exists():
 exports_path = settings.EXPORT_DIR
 
 if frontend_path.exists():
-    app.mount("/assets", StaticFiles(directory=frontend_path / "assets"), name="assets")
+    app.mount("/assets", CachedStaticFiles(directory=frontend_path / "assets"), name="assets")
     
     # exports 路由必须在 catch-all 之前
     if exports_path.exists():
         app.mount("/exports", StaticFiles(directory=exports_path, html=True), name="exports")
     
+    # 前端构建产物在运行期间不会变化: 启动时遍历一次建立文件索引，
+    # 并把 index.html 读入内存，请求时只做查表，不再逐次 stat/打开文件
+    frontend_files = {
+        p.relative_to(frontend_path).as_posix(): p
+        for p in frontend_path.rglob("*") if p.is_file()
+    }
+    index_html = (frontend_path / "index.html").read_bytes()
+    # index.html 引用的资源带内容哈希，入口页本身用 ETag 协商缓存: 未变化时只回 304
+    index_headers = {
+        "ETag": f'"{hashlib.md5(index_html).hexdigest()}"',
+        "Cache-Control": "no-cache",
+    }
+    
+    def index_response(request: Request) -> Response:
+        if request.headers.get("if-none-match") == index_headers["ETag"]:
+            return Response(status_code=304, headers=index_headers)
+        return Response(content=index_html, media_type="text/html", headers=index_headers)
+    
     @app.get("/")
-    async def serve_frontend():
-        return FileResponse(frontend_path / "index.html")
+    async def serve_frontend(request: Request):
+        return index_response(request)
     
     # 这个 catch-all 路由最后定义，但 mount 的优先级更高
     @app.get("/{path:path}")
-    async def serve_frontend_routes(path: str):
+    async def serve_frontend_routes(path: str, request: Request):
         # 对于 exports 开头的路径，返回 404 让 mount 处理（实际上不会执行到这里）
         if path.startswith("exports"):
             from fastapi import HTTPException
             raise HTTPException(status_code=404)
-        file_path = frontend_path / path
-        if file_path.exists() and file_path.is_file():
+        file_path = frontend_files.get(path)
+        if file_path is not None:
             return FileResponse(file_path)
-        return FileResponse(frontend_path / "index.html")
+        return index_response(request)
 
 
-@app.on_event("startup")
 async def startup_event():
     """启动事件"""
     print(f"""
@@ -115,8 +190,8 @@ async def startup_event():
 ║  API 文档: http://{settings.WEB_HOST}:{settings.WEB_PORT}/api/docs        ║
 ╚═══════════════════════════════════════════════════╝
     """)
-    # 初始化管理员用户
-    init_admin_user()
+    # 初始化管理员用户 (首次运行需要 bcrypt 哈希，放到线程中执行)
+    await asyncio.to_thread(init_admin_user)
     
     # 尝试自动恢复 Telegram 会话
     import os
@@ -182,11 +257,14 @@ async def startup_event():
         fix_recursive_permissions(Path(d_path))
 
 
-@app.on_event("shutdown")
 async def shutdown_event():
     """关闭事件"""
     from .telegram import telegram_client
     await telegram_client.stop()
+    
+    # Docker 客户端在整个进程生命周期内复用，只在退出时关闭
+    from .api.tdl_integration import tdl_integration
+    await tdl_integration.close()
 
 
 # 健康检查
@@ -175,6 +175,7 @@ class ChatInfo(BaseModel):
 class MessageInfo(BaseModel):
     """消息信息"""
     id: int
+    chat_id: Optional[int] = None         # 所属对话 ID (导出时按对话分组，旧数据可能缺失)
     date: datetime
     from_user_id: Optional[int] = None
     from_user_name: Optional[str] = None
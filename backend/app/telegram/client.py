@@ -4,6 +4,7 @@ TG Export - Telegram 客户端
 """
 import asyncio
 import os
+import time
 import logging
 from pathlib import Path
 from typing import Optional, List, AsyncGenerator, Union
@@ -95,7 +96,8 @@ class TelegramClient:
             # IPv6 自动检测与回退
             use_ipv6 = settings.USE_IPV6
             if use_ipv6:
-                use_ipv6 = self._check_ipv6_support()
+                # 阻塞式 socket 探测 (最长 2x3 秒) 放到线程中执行，避免卡住事件循环
+                use_ipv6 = await asyncio.to_thread(self._check_ipv6_support)
                 if not use_ipv6:
                     print("[TG] IPv6 不可用，自动切换到 IPv4")
             
@@ -231,7 +233,6 @@ class TelegramClient:
         if not self._client:
             return {}
             
-        import time
         # 1. 检查缓存 (5分钟有效)
         async with self._cache_lock:
             if self._me_cache and (time.time() - self._me_cache_time < 300):
@@ -353,7 +354,6 @@ class TelegramClient:
             return []
         
         # 简单缓存机制 (30秒内不再重复拉取)
-        import time
         if hasattr(self, '_dialogs_cache') and (time.time() - self._dialogs_last_fetch < 30):
             return self._dialogs_cache
 
@@ -484,7 +484,6 @@ class TelegramClient:
             return None
             
         cache_key = (chat_id, message_id)
-        import time
         
         # 1. 检查缓存 (1小时内有效，因为 file_reference 至少维持一段时间)
         async with self._cache_lock:
@@ -588,7 +587,6 @@ class TelegramClient:
         if not self._client:
             return None
         
-        from pathlib import Path
         from .parallel_downloader import ParallelChunkDownloader
         
         try:
@@ -1,6 +1,7 @@
 import logging
 import asyncio
 import re
+import time
 from pathlib import Path
 from typing import Dict, Set, Union, Optional, List
 from pyrogram.types import Message
@@ -8,6 +9,11 @@ from ..models import ExportTask, MediaType, DownloadItem, DownloadStatus
 
 logger = logging.getLogger(__name__)
 
+# 文件名清洗用正则 (模块级预编译，避免每次调用重新构建)
+_EMOJI_RE = re.compile("[" "\U0001F600-\U0001F64F" "\U0001F300-\U0001F5FF" "\U0001F680-\U0001F6FF" "\U0001F1E0-\U0001F1FF" "\U00002702-\U000027B0" "\U0001F900-\U0001F9FF" "\U0001FA00-\U0001FA6F" "\U0001FA70-\U0001FAFF" "\U00002600-\U000026FF" "]+", flags=re.UNICODE)
+_UNSAFE_CHARS_RE = re.compile(r'[^\w\u4e00-\u9fff.\-]')
+_MULTI_UNDERSCORE_RE = re.compile(r'_+')
+
 class ExporterBase:
     """导出器基础状态与实用工具"""
     
@@ -97,11 +103,13 @@ class ExporterBase:
 
     def _safe_filename(self, name: str) -> str:
         """生成安全的文件名"""
-        import re
-        emoji_pattern = re.compile("[" "\U0001F600-\U0001F64F" "\U0001F300-\U0001F5FF" "\U0001F680-\U0001F6FF" "\U0001F1E0-\U0001F1FF" "\U00002702-\U000027B0" "\U0001F900-\U0001F9FF" "\U0001FA00-\U0001FA6F" "\U0001FA70-\U0001FAFF" "\U00002600-\U000026FF" "]+", flags=re.UNICODE)
-        name = emoji_pattern.sub('', name)
-        name = re.sub(r'[^\w\u4e00-\u9fff.\-]', '_', name)
-        name = re.sub(r'_+', '_', name).strip('_')
+        # emoji 全部位于非 ASCII 区间，纯 ASCII 名称无需扫描
+        if not name.isascii():
+            name = _EMOJI_RE.sub('', name)
+        name = _UNSAFE_CHARS_RE.sub('_', name)
+        if '__' in name:
+            name = _MULTI_UNDERSCORE_RE.sub('_', name)
+        name = name.strip('_')
         return name[:100] if name else 'unnamed'
 
     async def _check_tdl_stuck(self, task: ExportTask, item: DownloadItem, target_sub_dir: str) -> bool:
@@ -112,7 +120,6 @@ class ExporterBase:
             prefix = f"{item.message_id}-"
             relevant_files = [f for f in sub_path.iterdir() if f.name.startswith(prefix)]
             if not relevant_files: return False
-            import time
             now = time.time()
             for f in relevant_files:
                 try:
@@ -17,6 +17,9 @@ class QueueManagerMixin:
         生产者的入口：将新项目存入维护列表，并视情况推入运行队列
         (v2.3.5) 实现生产-维护-消费分离
         """
+        # 每个项目都会经过这里，关闭 DEBUG 时不构造日志字符串
+        debug = logger.isEnabledFor(logging.DEBUG)
+        
         # 1. 确保项目状态为等待中
         if item.status == DownloadStatus.WAITING:
              # 可以根据需要在这里处理重复检查等逻辑
@@ -25,13 +28,15 @@ class QueueManagerMixin:
         # 2. 如果项目不在持久化列表中，则添加
         if not any(it.id == item.id for it in task.download_queue):
             task.download_queue.append(item)
-            logger.debug(f"项目 {item.id} 已进入待处理池 (WAITING)")
+            if debug:
+                logger.debug(f"项目 {item.id} 已进入待处理池 (WAITING)")
 
         # 3. 维护者逻辑：只有任务正在运行时，才推送到运行中的下载队列 (Consumer 管线)
         if task.status == TaskStatus.RUNNING and task.id in self._task_queues:
             self._task_queues[task.id].put_nowait(item)
-            logger.debug(f"维护者：由于任务运行中，已将项目 {item.id} 推送至下载管线")
-        else:
+            if debug:
+                logger.debug(f"维护者：由于任务运行中，已将项目 {item.id} 推送至下载管线")
+        elif debug:
             logger.debug(f"维护者：任务未运行 (当前状态: {task.status})，项目 {item.id} 在池中等待")
 
     def refill_task_queue(self, task: ExportTask):
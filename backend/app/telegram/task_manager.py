@@ -167,10 +167,12 @@ class TaskManagerMixin:
                 task.processed_chats += 1
                 await self._notify_progress(task_id, task)
             if all_new_messages and task.status not in [TaskStatus.CANCELLED, TaskStatus.PAUSED]:
-                from ..exporters import json_exporter, html_exporter
+                # 只加载本次导出格式需要的导出器
                 if task.options.export_format in [ExportFormat.JSON, ExportFormat.BOTH]:
+                    from ..exporters import json_exporter
                     await json_exporter.export(task, chats, all_new_messages, export_path)
                 if task.options.export_format in [ExportFormat.HTML, ExportFormat.BOTH]:
+                    from ..exporters import html_exporter
                     await html_exporter.export(task, chats, all_new_messages, export_path)
         except Exception as e:
             logger.error(f"扫描任务出错: {e}", exc_info=True)
@@ -1,5 +1,6 @@
 import asyncio
 import logging
+import os
 import time
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple, Union
@@ -10,6 +11,27 @@ from ..models import (
 
 logger = logging.getLogger(__name__)
 
+# TDL 下载过程中的临时文件后缀
+TEMP_SUFFIXES = ('.temp', '.tdl', '.tmp', '.part')
+
+
+def _scan_dir_sizes(path: str) -> Optional[Dict[str, int]]:
+    """单次 scandir 获取目录下所有文件的大小 (在线程中调用)"""
+    sizes = {}
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_file():
+                        sizes[entry.name] = entry.stat().st_size
+                except OSError:
+                    # TDL 可能在扫描过程中重命名临时文件
+                    continue
+    except OSError:
+        return None
+    return sizes
+
+
 class TDLBatcher:
     """TDL 批量请求聚合器 (v1.6.9)
     
@@ -21,6 +43,10 @@ class TDLBatcher:
         # key: (task_id, target_sub_dir) -> List[Tuple[DownloadItem, asyncio.Future]]
         self._active_batches = {}
         self._loop_task = None
+        # [v2.3.3] 全局磁盘嗅探: key: 每个批次独有的令牌 -> (task_id, target_sub_dir, batch, manager_inst)
+        # 同一任务同一目录可能有多个批次同时在下载，不能用 (task_id, target_sub_dir) 作键
+        self._monitored_batches = {}
+        self._monitor_task = None
         
     async def add_item(self, task: ExportTask, item: DownloadItem, target_sub_dir: str, manager_inst=None):
         """提交一个下载项到批量器 (v1.6.9)"""
@@ -58,10 +84,14 @@ class TDLBatcher:
         
         # 延迟导入以避免循环依赖
         from ..api.tdl_integration import tdl_integration
+        from ..api.websocket import manager as ws_manager
         task_id, target_sub_dir = batch_key
         
         # 提取 URL 列表
-        urls = [tdl_integration.generate_telegram_link(it.chat_id, it.message_id) for it, fut in batch]
+        urls = tdl_integration.generate_telegram_links(
+            [it.chat_id for it, fut in batch],
+            [it.message_id for it, fut in batch]
+        )
         
         if len(urls) > 1:
             logger.info(f"任务 {task_id[:8]}: [TDLBatcher] 聚合了 {len(urls)} 个下载项到目录: {target_sub_dir}")
@@ -77,9 +107,17 @@ class TDLBatcher:
             except:
                 pass
             
-            # [v2.3.1] 启动磁盘嗅探监视器 (每 10 秒刷新一次进度)
-            monitor_stop_event = asyncio.Event()
-            asyncio.create_task(self._monitor_temp_files(batch, target_sub_dir, monitor_stop_event, task_id, manager_inst))
+            # 任务有 WebSocket 订阅者时，把 TDL 输出实时转发给前端 (合并后推送)
+            on_output = None
+            if ws_manager.has_subscribers(task_id):
+                async def on_output(text: str):
+                    ws_manager.schedule_task_output(task_id, text)
+            
+            # [v2.3.3] 注册到全局磁盘嗅探监视器 (每 10 秒刷新一次进度)
+            monitor_key = object()
+            self._monitored_batches[monitor_key] = (task_id, target_sub_dir, batch, manager_inst)
+            if not self._monitor_task or self._monitor_task.done():
+                self._monitor_task = asyncio.create_task(self._monitor_loop())
             
             try:
                 # [v2.3.2] 统一权限与路径纠偏
@@ -92,15 +130,21 @@ class TDLBatcher:
                     output_dir=target_sub_dir,
                     threads=options.download_threads,
                     limit=len(urls),
-                    proxy=proxy_url
+                    proxy=proxy_url,
+                    on_output=on_output
                 )
             finally:
-                # 下载结束（无论成功失败），通知监视器停止
-                monitor_stop_event.set()
+                # 下载结束（无论成功失败），从监视器中移除
+                self._monitored_batches.pop(monitor_key, None)
                 # 批量完成后再次刷新权限，确保新产生文件的所有权
                 if manager_inst:
                     manager_inst._set_777_recursive(Path(target_sub_dir))
             
+            # 成功时在线程中对目录做一次 scandir，所有下载项共用这份快照回填大小
+            file_sizes = {}
+            if result.get("success"):
+                file_sizes = await asyncio.to_thread(_scan_dir_sizes, target_sub_dir) or {}
+            
             # 分发结果给所有等待的 Worker
             for it, fut in batch:
                 if not fut.done():
@@ -110,18 +154,13 @@ class TDLBatcher:
                         it.progress = 100.0
                         
                         # 检测路径并回填 (解决 99% 卡死)
-                        sub_path = Path(target_sub_dir)
                         search_prefix = f"{it.message_id}-{abs(it.chat_id)}-"
-                        try:
-                            # 遍历目录进行回填
-                            for f in sub_path.iterdir():
-                                if f.name.startswith(search_prefix) and not f.name.endswith(('.temp', '.tdl', '.tmp', '.part')):
-                                    # 找到了真实落地文件，更新下载大小
-                                    if it.file_size <= 0: it.file_size = f.stat().st_size
-                                    it.downloaded_size = f.stat().st_size
-                                    break
-                        except:
-                            pass
+                        for name, size in file_sizes.items():
+                            if name.startswith(search_prefix) and not name.endswith(TEMP_SUFFIXES):
+                                # 找到了真实落地文件，更新下载大小
+                                if it.file_size <= 0: it.file_size = size
+                                it.downloaded_size = size
+                                break
                         
                         if it.file_size > 0: it.downloaded_size = it.file_size
                     fut.set_result(result)
@@ -137,59 +176,36 @@ class TDLBatcher:
                 if not fut.done():
                     fut.set_result({"success": False, "error": "批量任务异常中止", "output": ""})
 
-    async def _monitor_temp_files(self, batch, target_sub_dir: str, stop_event: asyncio.Event, task_id: str, manager_inst=None):
-        """磁盘嗅探监视器 (v2.3.1.3)"""
-        sub_path = Path(target_sub_dir)
-        logger.info(f"任务 {task_id[:8]}: [磁盘嗅探] 开始监控目录: {target_sub_dir}")
-        
-        while not stop_event.is_set():
+    async def _monitor_loop(self):
+        """全局磁盘嗅探监视器 (v2.3.3)
+
+        所有批次共用一个协程，每轮每个目录只扫描一次，没有活跃批次时自动退出。
+        """
+        logger.info("[磁盘嗅探] 全局监视器已启动")
+        while self._monitored_batches:
             try:
-                try:
-                    await asyncio.wait_for(stop_event.wait(), timeout=10.0)
-                    break 
-                except asyncio.TimeoutError:
-                    pass
+                await asyncio.sleep(10.0)
                 
-                if not sub_path.exists():
-                    continue
+                entries = list(self._monitored_batches.items())
+                if not entries:
+                    break
                 
-                temp_files = []
-                for ext in ["*.temp", "*.tdl", "*.tmp", "*.part"]:
-                    temp_files.extend(list(sub_path.glob(ext)))
+                # 一次线程调用完成所有目录的扫描
+                dirs = list({target_sub_dir for _, (_, target_sub_dir, _, _) in entries})
+                dir_sizes = await asyncio.to_thread(lambda: {d: _scan_dir_sizes(d) for d in dirs})
                 
-                updated_count = 0
-                for it, fut in batch:
-                    if it.status != DownloadStatus.DOWNLOADING:
+                updated_tasks = {}
+                for monitor_key, (task_id, target_sub_dir, batch, manager_inst) in entries:
+                    # 扫描期间已完成的批次直接跳过
+                    if monitor_key not in self._monitored_batches:
                         continue
-                    
-                    # 匹配逻辑：找文件名包含 message_id 的临时文件
-                    found = False
-                    prefix = f"{it.message_id}-"
-                    for tf in temp_files:
-                        if tf.name.startswith(prefix):
-                            try:
-                                current_size = tf.stat().st_size
-                                if it.file_size > 0:
-                                    it.downloaded_size = current_size
-                                    it.progress = min(99.9, (current_size / it.file_size) * 100.0)
-                                    updated_count += 1
-                                    found = True
-                            except: pass
-                            break
-                    
-                    # 容错：如果找不到 .temp 但原文件已存在且在增长，也可以作为进度（虽然 TDL 通常先写临时文件）
-                    if not found and it.file_path:
-                        f_path = sub_path / Path(it.file_path).name
-                        if f_path.exists():
-                            try:
-                                current_size = f_path.stat().st_size
-                                if it.file_size > 0 and current_size < it.file_size:
-                                    it.downloaded_size = current_size
-                                    it.progress = (current_size / it.file_size) * 100.0
-                                    updated_count += 1
-                            except: pass
-
-                if updated_count > 0 and manager_inst:
+                    file_sizes = dir_sizes.get(target_sub_dir)
+                    if file_sizes is None:
+                        continue
+                    if self._apply_file_sizes(batch, file_sizes) > 0 and manager_inst:
+                        updated_tasks[task_id] = manager_inst
+                
+                for task_id, manager_inst in updated_tasks.items():
                     task = manager_inst.get_task(task_id)
                     if task:
                         # 核心：必须更新任务总计统计，否则 UI 上的总进度条不动
@@ -201,3 +217,35 @@ class TDLBatcher:
             except Exception as e:
                 logger.error(f"[磁盘嗅探] 核心循环出错: {e}")
                 await asyncio.sleep(5)
+
+    @staticmethod
+    def _apply_file_sizes(batch, file_sizes: Dict[str, int]) -> int:
+        """根据目录快照回填批次内各下载项的进度，返回更新数量"""
+        temp_files = [name for name in file_sizes if name.endswith(TEMP_SUFFIXES)]
+        
+        updated_count = 0
+        for it, fut in batch:
+            if it.status != DownloadStatus.DOWNLOADING:
+                continue
+            
+            # 匹配逻辑：找文件名包含 message_id 的临时文件
+            found = False
+            prefix = f"{it.message_id}-"
+            for name in temp_files:
+                if name.startswith(prefix):
+                    current_size = file_sizes[name]
+                    if it.file_size > 0:
+                        it.downloaded_size = current_size
+                        it.progress = min(99.9, (current_size / it.file_size) * 100.0)
+                        updated_count += 1
+                        found = True
+                    break
+            
+            # 容错：如果找不到 .temp 但原文件已存在且在增长，也可以作为进度（虽然 TDL 通常先写临时文件）
+            if not found and it.file_path:
+                current_size = file_sizes.get(Path(it.file_path).name)
+                if current_size is not None and it.file_size > 0 and current_size < it.file_size:
+                    it.downloaded_size = current_size
+                    it.progress = (current_size / it.file_size) * 100.0
+                    updated_count += 1
+        return updated_count
@@ -0,0 +1,314 @@
+"""
+tdl_integration 单元测试
+在 Unix socket 上运行一个最小的假 Docker daemon，覆盖 HTTP 解析、连接复用与 exec 流程。
+
+运行: python -m pytest -q backend/tests  (或 python -m unittest discover backend/tests)
+"""
+import asyncio
+import importlib.util
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from pathlib import Path
+
+# tdl_integration 只依赖标准库 (orjson 可选)，直接按文件加载，
+# 避免导入 app.api 包时连带导入 FastAPI 路由
+_MODULE_PATH = Path(__file__).resolve().parents[1] / "app" / "api" / "tdl_integration.py"
+_spec = importlib.util.spec_from_file_location("tdl_integration", _MODULE_PATH)
+tdl = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(tdl)
+
+
+def _frame(stream_type: int, payload: bytes) -> bytes:
+    """构造一帧 Docker 多路复用流"""
+    return struct.pack(">BxxxI", stream_type, len(payload)) + payload
+
+
+def _chunked(body: bytes, pieces: int = 5) -> bytes:
+    """按 chunked 编码切分响应体"""
+    step = max(1, len(body) // pieces)
+    out = b""
+    for i in range(0, len(body), step):
+        part = body[i:i + step]
+        out += b"%x\r\n" % len(part) + part + b"\r\n"
+    return out + b"0\r\n\r\n"
+
+
+class FakeDocker:
+    """最小的假 Docker daemon
+
+    exec: 下一次 exec 的行为，exec create 时取走
+        frames: 输出帧列表; start_status: 101 或 200;
+        exit_code: 退出码; running_polls: 前几次 inspect 返回 Running=true (None 表示一直运行);
+        hold_open: 输出写完后保持连接直到客户端关闭
+    """
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self.server = None
+        self.connections = 0
+        self.requests = []  # (method, path, body)
+        self.drop_reused = False  # 为 True 时，复用连接上的下一个请求读到后直接断开不响应
+        self.next_exec = {}
+        self._execs = {}
+
+    async def start(self):
+        self.server = await asyncio.start_unix_server(self._handle, self.socket_path)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def count(self, method: str, path: str) -> int:
+        return sum(1 for m, p, _ in self.requests if m == method and p == path)
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        served = 0
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionResetError):
+                    return
+                lines = head.decode().split("\r\n")
+                method, path, _ = lines[0].split(" ", 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                length = int(headers.get("content-length", "0"))
+                body = json.loads(await reader.readexactly(length)) if length else None
+                self.requests.append((method, path, body))
+
+                if served and self.drop_reused:
+                    # 模拟 daemon 关闭了空闲连接: 请求已到达但没有任何响应
+                    self.drop_reused = False
+                    return
+                served += 1
+
+                if method == "POST" and path.startswith("/exec/") and path.endswith("/start") and not body.get("Detach"):
+                    await self._stream_exec(path.split("/")[2], reader, writer)
+                    return
+                status, payload, chunked = self._route(method, path, body)
+                data = b"" if payload is None else json.dumps(payload).encode()
+                if chunked:
+                    writer.write(f"HTTP/1.1 {status} X\r\nTransfer-Encoding: chunked\r\n\r\n".encode() + _chunked(data))
+                else:
+                    writer.write(f"HTTP/1.1 {status} X\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def _route(self, method, path, body):
+        if path == "/version":
+            return 200, {"Version": "24.0"}, False
+        if path == "/big":
+            return 200, {"data": "x" * 200000}, True
+        if path.startswith("/containers/json?"):
+            return 200, [{"Id": "c1", "Names": ["/tdl"], "State": "running"}], False
+        if path == "/containers/tdl/exec":
+            exec_id = f"exec{len(self._execs)}"
+            spec = {"frames": [], "start_status": 101, "exit_code": 0, "running_polls": 0, "hold_open": False}
+            spec.update(self.next_exec)
+            spec["cmd"] = body["Cmd"]
+            self.next_exec = {}
+            self._execs[exec_id] = spec
+            return 201, {"Id": exec_id}, False
+        if path.startswith("/exec/") and path.endswith("/start"):
+            return 200, None, False  # Detach 模式 (kill_process)
+        if path.startswith("/exec/") and path.endswith("/json"):
+            spec = self._execs[path.split("/")[2]]
+            polls = spec["running_polls"]
+            running = polls is None or polls > 0
+            if polls:
+                spec["running_polls"] = polls - 1
+            return 200, {"Running": running, "ExitCode": None if running else spec["exit_code"]}, False
+        return 404, {"message": "not found"}, False
+
+    async def _stream_exec(self, exec_id, reader, writer):
+        spec = self._execs[exec_id]
+        reason = "UPGRADED" if spec["start_status"] == 101 else "OK"
+        writer.write(f"HTTP/1.1 {spec['start_status']} {reason}\r\nContent-Type: application/vnd.docker.raw-stream\r\n\r\n".encode())
+        for stream_type, payload in spec["frames"]:
+            writer.write(_frame(stream_type, payload))
+            await writer.drain()
+            await asyncio.sleep(0.01)
+        if spec["hold_open"]:
+            await reader.read()  # 等客户端关闭连接
+
+
+class DockerTestCase(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.docker = FakeDocker(os.path.join(self.tmp_dir, "docker.sock"))
+        await self.docker.start()
+        self.client = tdl.AsyncDockerClient(self.docker.socket_path)
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        await self.docker.stop()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class HttpClientTest(DockerTestCase):
+
+    async def test_content_length_and_chunked_bodies(self):
+        result = await self.client._make_request("GET", "/version")
+        self.assertEqual(result["status_code"], 200)
+        self.assertEqual(result["data"], {"Version": "24.0"})
+
+        result = await self.client._make_request("GET", "/big")
+        self.assertEqual(result["status_code"], 200)
+        self.assertEqual(len(result["data"]["data"]), 200000)
+
+        result = await self.client._make_request("GET", "/nope")
+        self.assertEqual(result["status_code"], 404)
+        # keep-alive: 三个请求共用一条连接
+        self.assertEqual(self.docker.connections, 1)
+
+    async def test_batch_pipelines_requests(self):
+        results = await self.client.batch([("GET", "/version", None), ("GET", "/big", None), ("GET", "/nope", None)])
+        self.assertEqual([r["status_code"] for r in results], [200, 200, 404])
+        self.assertEqual(self.docker.connections, 1)
+
+    async def test_stale_connection_retries_get(self):
+        await self.client._make_request("GET", "/version")
+        self.docker.drop_reused = True
+        result = await self.client._make_request("GET", "/version")
+        self.assertEqual(result["status_code"], 200)
+        self.assertEqual(self.docker.count("GET", "/version"), 3)
+        self.assertEqual(self.docker.connections, 2)
+
+    async def test_stale_connection_does_not_replay_post(self):
+        await self.client._make_request("GET", "/version")
+        self.docker.drop_reused = True
+        result = await self.client._make_request("POST", "/containers/tdl/exec", {"Cmd": ["true"]})
+        self.assertNotEqual(result["status_code"], 201)
+        self.assertIn("error", result)
+        # 请求已送达 daemon，不能在新连接上重放
+        self.assertEqual(self.docker.count("POST", "/containers/tdl/exec"), 1)
+
+    async def test_concurrent_status_checks_query_once(self):
+        results = await asyncio.gather(*[self.client.check_status("tdl") for _ in range(5)])
+        self.assertEqual(results, [(True, None, True, None)] * 5)
+        queries = [p for m, p, _ in self.docker.requests if p.startswith("/containers/json?")]
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.docker.count("GET", "/version"), 1)
+
+
+class ExecCommandTest(DockerTestCase):
+
+    async def test_streams_output_for_101_and_200(self):
+        text = "下载完成\n".encode()
+        for start_status in (101, 200):
+            with self.subTest(start_status=start_status):
+                self.docker.next_exec = {
+                    "start_status": start_status,
+                    # 多字节字符跨帧截断
+                    "frames": [(1, b"progress 50%\n"), (2, b"warn\n"), (1, text[:4]), (1, text[4:])],
+                }
+                chunks = []
+
+                async def on_output(chunk):
+                    chunks.append(chunk)
+
+                result = await self.client.exec_command("tdl", ["tdl", "dl"], timeout=10, on_output=on_output)
+                self.assertTrue(result["success"], result)
+                self.assertEqual(result["output"], "progress 50%\nwarn\n下载完成\n")
+                self.assertEqual("".join(chunks), result["output"])
+
+    async def test_nonzero_exit_code(self):
+        self.docker.next_exec = {"frames": [(2, b"database is used by another process\n")], "exit_code": 3}
+        result = await self.client.exec_command("tdl", ["tdl", "dl"], timeout=10)
+        self.assertFalse(result["success"])
+        self.assertEqual(result["error"], "ExitCode=3")
+        self.assertIn("database is used by another process", result["output"])
+
+    async def test_log_path_wraps_command(self):
+        result = await self.client.exec_command("tdl", ["tdl", "dl"], timeout=10, log_path="/downloads/x/.tdl.log")
+        self.assertTrue(result["success"], result)
+        cmd = self.docker._execs["exec0"]["cmd"]
+        self.assertEqual(cmd[:3], ["sh", "-c", tdl._LOG_WRAPPER])
+        self.assertEqual(cmd[4:], ["/downloads/x/.tdl.log", "tdl", "dl"])
+
+    async def test_timeout(self):
+        self.docker.next_exec = {"running_polls": None, "hold_open": True}
+        result = await self.client.exec_command("tdl", ["tdl", "dl"], timeout=0.3)
+        self.assertEqual(result, {"success": False, "error": "执行超时"})
+
+    async def test_stuck_check_after_stream_ends_early(self):
+        # 输出流提前断开而进程仍在运行: 卡死检测照常生效
+        self.docker.next_exec = {"running_polls": None}
+        result = await self.client.exec_command(
+            "tdl", ["tdl", "dl"], timeout=10,
+            stuck_check_callback=lambda: True, stuck_check_interval=0.05
+        )
+        self.assertEqual(result["error"], "Stuck detected (File not growing)")
+        kill_cmd = self.docker._execs["exec1"]["cmd"]
+        self.assertIn("killall -9 tdl", kill_cmd[-1])
+
+    async def test_missing_container(self):
+        self.docker.next_exec = {}
+        result = await self.client.exec_command("missing", ["true"], timeout=10)
+        self.assertEqual(result, {"success": False, "error": "容器 'missing' 不存在"})
+
+
+class InflightDedupeTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.downloader = tdl.TDLDownloader()
+        self.release = asyncio.Event()
+        self.runs = []
+
+        async def run_download(*args):
+            self.runs.append(args)
+            await self.release.wait()
+            return {"success": True}
+
+        self.downloader._run_download = run_download
+
+    async def test_identical_downloads_share_one_run(self):
+        first = asyncio.create_task(self.downloader.download(["u1", "u2"], "/d"))
+        second = asyncio.create_task(self.downloader.download(["u2", "u1"], "/d"))
+        other_proxy = asyncio.create_task(self.downloader.download(["u1", "u2"], "/d", proxy="socks5://p"))
+        await asyncio.sleep(0.01)
+        self.assertEqual(len(self.runs), 2)
+
+        self.release.set()
+        self.assertEqual(await first, {"success": True})
+        self.assertEqual(await second, {"success": True})
+        self.assertEqual(await other_proxy, {"success": True})
+        await asyncio.sleep(0)
+        self.assertEqual(self.downloader._inflight, {})
+
+    async def test_cancelling_first_caller_keeps_shared_download(self):
+        first = asyncio.create_task(self.downloader.download(["u1"], "/d"))
+        second = asyncio.create_task(self.downloader.download(["u1"], "/d"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+
+        self.release.set()
+        self.assertEqual(await second, {"success": True})
+        self.assertEqual(len(self.runs), 1)
+
+    async def test_cancelling_all_callers_cancels_download(self):
+        callers = [asyncio.create_task(self.downloader.download(["u1"], "/d")) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        shared = next(iter(self.downloader._inflight.values()))
+        for caller in callers:
+            caller.cancel()
+        await asyncio.sleep(0.01)
+        self.assertTrue(shared.cancelled())
+        self.assertEqual(self.downloader._inflight, {})
+        self.assertEqual(self.downloader._inflight_waiters, {})
+
+
+if __name__ == "__main__":
+    unittest.main()